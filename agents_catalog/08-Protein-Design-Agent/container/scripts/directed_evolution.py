@@ -1,14 +1,16 @@
 import argparse
+import hashlib
 import json
 import os
 import logging
 import boto3
-import subprocess
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 import torch
 import evo_prot_grad
-from transformers import AutoModel, EsmForMaskedLM, AutoTokenizer
+from transformers import AutoModel, EsmForMaskedLM, AutoTokenizer, BatchEncoding, BitsAndBytesConfig
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -21,7 +23,37 @@ logging.basicConfig(
     level=logging.INFO,
 )
 
-def download_s3_folder(s3_uri, local_dir):
+MODEL_CONFIG_FILE = "config.json"
+MODEL_WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+
+
+def has_model_files(local_dir):
+    """
+    Check whether a local directory already holds a Hugging Face model
+    """
+    if not os.path.isdir(local_dir):
+        return False
+    files = set(os.listdir(local_dir))
+    return MODEL_CONFIG_FILE in files and any(f in files for f in MODEL_WEIGHT_FILES)
+
+
+def local_model_dirname(s3_uri):
+    """
+    Name of the local directory an S3 model folder is downloaded to
+    """
+    s3_uri = s3_uri.rstrip('/')
+    uri_hash = hashlib.sha256(s3_uri.encode('utf-8')).hexdigest()[:16]
+    return f"{os.path.basename(s3_uri)}-{uri_hash}"
+
+
+S3_TRANSFER_CONFIG = TransferConfig(
+    max_concurrency=20,
+    multipart_chunksize=16 * 1024 * 1024,
+    use_threads=True,
+)
+
+
+def download_s3_folder(s3_uri, local_dir, max_workers=8):
     """
     Download a folder from S3 to a local directory
     """
@@ -34,17 +66,217 @@ def download_s3_folder(s3_uri, local_dir):
     
     logging.info(f"Downloading from bucket: {bucket_name}, prefix: {prefix} to {local_dir}")
     
-    # Use AWS CLI for efficient recursive download
-    cmd = f"aws s3 cp --recursive s3://{bucket_name}/{prefix} {local_dir}"
-    logging.info(f"Running command: {cmd}")
+    # Reuse one client for listing and for the (multipart) object downloads
+    s3 = boto3.client('s3')
+    paginator = s3.get_paginator('list_objects_v2')
+    
+    downloads = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if key.endswith('/'):
+                continue
+            local_path = os.path.join(local_dir, os.path.relpath(key, prefix))
+            # Like 'aws s3 sync', skip files that are already present with the same size
+            if os.path.exists(local_path) and os.path.getsize(local_path) == obj['Size']:
+                continue
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            downloads.append((key, local_path))
+    
+    def _download(item):
+        key, local_path = item
+        s3.download_file(bucket_name, key, local_path, Config=S3_TRANSFER_CONFIG)
     
     try:
-        subprocess.check_call(cmd, shell=True)
-        logging.info(f"Successfully downloaded S3 folder to {local_dir}")
-    except subprocess.CalledProcessError as e:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_download, downloads))
+        logging.info(f"Successfully downloaded {len(downloads)} files from S3 folder to {local_dir}")
+    except Exception as e:
         logging.error(f"Failed to download S3 folder: {e}")
         raise
 
+def get_model_dtype(device, quantize=False):
+    """
+    Pick the precision to load the generator pLM weights in.
+
+    bf16 on GPUs that support it, fp16 on older GPUs (T4/V100) and fp32 on CPU.
+    8-bit quantized models keep their non-quantized modules in fp16, which is
+    what the bitsandbytes int8 matmul expects as input.
+    """
+    if device != "cuda":
+        return torch.float32
+    if quantize:
+        return torch.float16
+    if torch.cuda.is_bf16_supported():
+        return torch.bfloat16
+    return torch.float16
+
+
+def load_esm_model(model_name_or_path, dtype, quantize=False):
+    """
+    Load the ESM masked LM, optionally with 8-bit (LLM.int8) linear layers
+    """
+    load_kwargs = {"torch_dtype": dtype, "trust_remote_code": True}
+    if quantize:
+        load_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+        load_kwargs["device_map"] = "auto"
+
+    # Prefer the fused scaled_dot_product_attention kernels. Older transformers
+    # releases have no SDPA path for ESM and reject the argument.
+    try:
+        model = EsmForMaskedLM.from_pretrained(model_name_or_path, attn_implementation="sdpa", **load_kwargs)
+    except ValueError as e:
+        logging.info(f"SDPA attention not available for ESM, using eager attention: {e}")
+        model = EsmForMaskedLM.from_pretrained(model_name_or_path, **load_kwargs)
+
+    if quantize:
+        # accelerate has already placed the quantized weights on the GPU, and
+        # bitsandbytes 8-bit models reject the model.to(device) call that
+        # evo_prot_grad makes when building the expert
+        model.to = lambda *args, **kwargs: model
+    return model
+
+
+def autocast_expert(expert, dtype):
+    """
+    Run a pLM expert's forward pass under autocast.
+
+    The experts build fp32 one-hot inputs, so autocast is needed for them to
+    run against half-precision weights. Only the generator experts are wrapped,
+    so the scorer CNN keeps running in fp32.
+    """
+    get_model_output = expert.get_model_output
+
+    def _get_model_output(inputs):
+        with torch.autocast(device_type=expert.device, dtype=dtype):
+            oh, logits = get_model_output(inputs)
+        # Score variants from fp32 logits, as log_softmax would under autocast
+        return oh, logits.float()
+
+    expert.get_model_output = _get_model_output
+    return expert
+
+
+class WildtypeCachedTokenizer:
+    """
+    Stand-in for the ESM tokenizer used by the evo_prot_grad ESM expert.
+
+    Every MCMC proposal is a substitution variant of the wildtype, so the
+    wildtype is tokenized once and each proposal only writes the token IDs of
+    its mutated positions, looked up in an amino acid -> token ID table. This
+    keeps the (slow) Hugging Face tokenizer out of the sampling loop.
+    """
+    def __init__(self, tokenizer, wt_seq):
+        self.tokenizer = tokenizer
+        self.vocab = tokenizer.get_vocab()
+        self.unk_token_id = tokenizer.unk_token_id
+        self.wt_tokens = wt_seq.split() if ' ' in wt_seq else list(wt_seq)
+        self.wt_ids = torch.tensor([self.vocab.get(aa, self.unk_token_id) for aa in self.wt_tokens])
+
+    def get_vocab(self):
+        return self.vocab
+
+    def __call__(self, inputs, add_special_tokens=False, return_tensors="pt", **kwargs):
+        seqs = [seq.split() for seq in inputs]
+        if add_special_tokens or return_tensors != "pt" or kwargs \
+                or any(len(seq) != len(self.wt_tokens) for seq in seqs):
+            return self.tokenizer(inputs, add_special_tokens=add_special_tokens, return_tensors=return_tensors, **kwargs)
+
+        rows, cols, ids = [], [], []
+        for row, seq in enumerate(seqs):
+            for col, (aa, wt_aa) in enumerate(zip(seq, self.wt_tokens)):
+                if aa != wt_aa:
+                    rows.append(row)
+                    cols.append(col)
+                    ids.append(self.vocab.get(aa, self.unk_token_id))
+
+        input_ids = self.wt_ids.repeat(len(seqs), 1)
+        if rows:
+            input_ids.index_put_((torch.tensor(rows), torch.tensor(cols)), torch.tensor(ids))
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)})
+
+
+CHECKPOINT_FILENAME = "checkpoint.pt"
+
+# Arguments that change the sampled chains; a checkpoint only resumes a run
+# with the same values
+RUN_CONFIG_ARGS = (
+    "wt_seq",
+    "esm_expert_name_or_path",
+    "bert_expert_name_or_path",
+    "scorer_expert_name_or_path",
+    "output_type",
+    "parallel_chains",
+    "n_steps",
+    "max_mutations",
+    "quantize",
+)
+
+
+def get_run_config(args):
+    """
+    Collect the arguments that define a directed evolution run
+    """
+    return {name: getattr(args, name) for name in RUN_CONFIG_ARGS}
+
+
+def save_checkpoint(checkpoint_path, directed_evolution, step, run_config):
+    """
+    Save the MCMC chain state, sampling history and RNG state after `step` steps
+    """
+    state = {
+        "run_config": run_config,
+        "step": step,
+        "chains": directed_evolution.chains,
+        "chains_oh": directed_evolution.chains_oh.detach().cpu(),
+        "chains_oh_history": [x.detach().cpu() for x in directed_evolution.chains_oh_history],
+        "PoE_history": [x.detach().cpu() for x in directed_evolution.PoE_history],
+        "torch_rng_state": torch.random.get_rng_state(),
+        "cuda_rng_state": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        "numpy_rng_state": np.random.get_state(),
+    }
+    # Write to a temporary file first so a kill mid-save keeps the last checkpoint
+    tmp_path = checkpoint_path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, checkpoint_path)
+    logging.info(f"Saved checkpoint at step {step} to {checkpoint_path}")
+
+
+def load_checkpoint(checkpoint_path, directed_evolution, run_config):
+    """
+    Restore a checkpoint written by `save_checkpoint` into `directed_evolution`.
+
+    Returns the number of MCMC steps already completed, 0 if there is no
+    checkpoint. Raises ValueError if the checkpoint was written by a run
+    with a different configuration.
+    """
+    if not os.path.exists(checkpoint_path):
+        return 0
+    state = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    saved_config = state.get("run_config", {})
+    mismatched = sorted(
+        name for name in RUN_CONFIG_ARGS if saved_config.get(name) != run_config[name]
+    )
+    if mismatched:
+        raise ValueError(
+            f"Checkpoint {checkpoint_path} was written by a run with different "
+            f"{', '.join(mismatched)}. Delete it or pass another --checkpoint_path "
+            f"to start a new run."
+        )
+
+    device = directed_evolution.device
+    directed_evolution.chains = state["chains"]
+    directed_evolution.chains_oh = state["chains_oh"].to(device)
+    directed_evolution.chains_oh_history = [x.to(device) for x in state["chains_oh_history"]]
+    directed_evolution.PoE_history = [x.to(device) for x in state["PoE_history"]]
+    torch.random.set_rng_state(state["torch_rng_state"])
+    if state["cuda_rng_state"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda_rng_state"])
+    np.random.set_state(state["numpy_rng_state"])
+    logging.info(f"Resuming from checkpoint {checkpoint_path} at step {state['step']}")
+    return state["step"]
+
+
 def _parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -79,7 +311,9 @@ def _parse_args():
     )
     parser.add_argument(
         "--parallel_chains",
-        help="Number of MCMC chains to run in parallel",
+        help="Number of MCMC chains to run in parallel. All chains are scored "
+             "in one batched forward pass per expert, so larger values mostly "
+             "improve GPU utilization",
         default=5,
         type=int,
     )
@@ -95,6 +329,24 @@ def _parse_args():
         default=10,
         type=int,
     )
+    parser.add_argument(
+        "--checkpoint_every",
+        help="Save a checkpoint to resume from every N MCMC steps, 0 to disable",
+        default=10,
+        type=int,
+    )
+    parser.add_argument(
+        "--checkpoint_path",
+        help=f"Checkpoint file, defaults to {CHECKPOINT_FILENAME} in output_path",
+        default=None,
+        type=str,
+    )
+    parser.add_argument('--quantize',
+                        action='store_true',
+                        help='Load the ESM model with 8-bit linear layers (GPU only)')
+    parser.add_argument('--compile',
+                        action='store_true',
+                        help='Compile the ESM encoder with torch.compile')
     parser.add_argument('--verbose', 
                         action='store_true', 
                         help='Enable verbose output')
@@ -108,23 +360,30 @@ def get_expert_list(args):
     # Handle S3 paths for ESM model
     if args.esm_expert_name_or_path is not None and args.esm_expert_name_or_path != "None":
         if args.esm_expert_name_or_path.startswith('s3://'):
-            # Create a temporary directory for the model
+            # Create a temporary directory for the model, keyed on the full S3 URI
+            # so different models never share (and reuse) the same local files
             tmp_dir = os.environ.get('TMPDIR', '/tmp')
-            esm_model_dir = os.path.join(tmp_dir, 
-                                os.path.basename(os.path.dirname(args.esm_expert_name_or_path.rstrip('/'))))
+            esm_model_dir = os.path.join(tmp_dir, local_model_dirname(args.esm_expert_name_or_path))
             if not os.path.exists(esm_model_dir):
                 os.makedirs(esm_model_dir, exist_ok=True)
             
-            logging.info(f'Downloading ESM model files from {args.esm_expert_name_or_path} to {esm_model_dir}')
-            download_s3_folder(args.esm_expert_name_or_path, esm_model_dir)
-            logging.info(f'Downloaded files: {os.listdir(esm_model_dir)}')
+            if has_model_files(esm_model_dir):
+                logging.info(f'ESM model files already present in {esm_model_dir}, skipping download')
+            else:
+                logging.info(f'Downloading ESM model files from {args.esm_expert_name_or_path} to {esm_model_dir}')
+                download_s3_folder(args.esm_expert_name_or_path, esm_model_dir)
+                logging.info(f'Downloaded files: {os.listdir(esm_model_dir)}')
             
             # Update the path to use the local directory
             args.esm_expert_name_or_path = esm_model_dir
             logging.info(f'Using local ESM model path: {args.esm_expert_name_or_path}')
     
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    logging.info(f"Using device: {device}")
+    if args.quantize and device != "cuda":
+        logging.warning("8-bit quantization requires a GPU, loading the ESM model without it")
+        args.quantize = False
+    dtype = get_model_dtype(device, args.quantize)
+    logging.info(f"Using device: {device}, generator dtype: {dtype}, 8-bit: {args.quantize}")
     
     expert_list = []
     assert ((args.esm_expert_name_or_path != 'None') ^ (args.bert_expert_name_or_path != 'None')),\
@@ -135,12 +394,23 @@ def get_expert_list(args):
         logging.info(f"Loading ESM model from {args.esm_expert_name_or_path}")
         esm2_expert = evo_prot_grad.get_expert(
             'esm',
-            model=EsmForMaskedLM.from_pretrained(args.esm_expert_name_or_path, trust_remote_code=True),
-            tokenizer=AutoTokenizer.from_pretrained(args.esm_expert_name_or_path, trust_remote_code=True),
+            model=load_esm_model(args.esm_expert_name_or_path, dtype, args.quantize),
+            tokenizer=WildtypeCachedTokenizer(
+                AutoTokenizer.from_pretrained(args.esm_expert_name_or_path, trust_remote_code=True),
+                args.wt_seq,
+            ),
             scoring_strategy = 'mutant_marginal',
             temperature=1.0,
             device=device
         )
+        if args.compile:
+            # Only the transformer encoder is compiled. The one-hot embedding
+            # layer evo_prot_grad swaps in caches its inputs for the gradient
+            # step and stays eager. Chains only see substitutions, so the
+            # input shape is fixed across MCMC steps and compiles once.
+            esm2_expert.model.esm.encoder = torch.compile(esm2_expert.model.esm.encoder)
+        if dtype != torch.float32:
+            autocast_expert(esm2_expert, dtype)
         expert_list.append(esm2_expert)
     elif args.bert_expert_name_or_path != "None":
         logging.info(f"Loading BERT model from {args.bert_expert_name_or_path}")
@@ -148,11 +418,14 @@ def get_expert_list(args):
             'bert',
             scoring_strategy='pseudolikelihood_ratio', 
             temperature=1.0,
-            model=AutoModel.from_pretrained(args.bert_expert_name_or_path, trust_remote_code=True),
+            model=AutoModel.from_pretrained(args.bert_expert_name_or_path, torch_dtype=dtype, trust_remote_code=True),
             device=device
         )
+        if dtype != torch.float32:
+            autocast_expert(bert_expert, dtype)
         expert_list.append(bert_expert)
     
+    # The scorer CNN is small, so it stays in fp32 and runs outside autocast
     if args.scorer_expert_name_or_path != "None":
         logging.info(f"Loading scorer model from {args.scorer_expert_name_or_path}")
         scorer_expert = evo_prot_grad.get_expert(
@@ -164,6 +437,12 @@ def get_expert_list(args):
         )
         expert_list.append(scorer_expert)
     
+    # The sampler differentiates the expert scores with respect to the one-hot
+    # inputs only. Freezing the weights stops autograd from computing and
+    # storing weight gradients in every backward pass.
+    for expert in expert_list:
+        expert.model.requires_grad_(False)
+    
     return expert_list
         
 
@@ -171,8 +450,14 @@ def run_evo_prot_grad(args):
     '''
     Run the specified expert pipeline on the wildtype sequence to evolve it. 
     '''
+    # Let fp32 matmuls and convolutions (e.g. the scorer CNN) use TF32 tensor cores
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
+    # Taken before get_expert_list replaces S3 model URIs with local paths
+    run_config = get_run_config(args)
     expert_list = get_expert_list(args)
-        
+
     # Initialize Directed Evolution with the specified experts
     directed_evolution = evo_prot_grad.DirectedEvolution(
         wt_protein=args.wt_seq,
@@ -184,8 +469,19 @@ def run_evo_prot_grad(args):
         verbose=args.verbose                 
     )
 
-    # Run the evolution process
-    variants, scores = directed_evolution()
+    # Run the evolution process in segments of `checkpoint_every` steps.
+    # DirectedEvolution keeps the chain state and history between calls,
+    # so this samples the same chain as a single call of `n_steps`.
+    checkpoint_path = args.checkpoint_path or os.path.join(args.output_path, CHECKPOINT_FILENAME)
+    step = load_checkpoint(checkpoint_path, directed_evolution, run_config) if args.checkpoint_every > 0 else 0
+    segment_steps = args.checkpoint_every if args.checkpoint_every > 0 else args.n_steps
+    while True:
+        directed_evolution.n_steps = min(segment_steps, args.n_steps - step)
+        variants, scores = directed_evolution()
+        step += directed_evolution.n_steps
+        if step >= args.n_steps:
+            break
+        save_checkpoint(checkpoint_path, directed_evolution, step, run_config)
 
     # Write results to file 
     directed_evolution.save_results(
@@ -195,6 +491,10 @@ def run_evo_prot_grad(args):
         n_seqs_to_keep=None, #keep all
         )
 
+    # The run is complete, so a later invocation should start from scratch
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
 if __name__ == "__main__":
     args, _ = _parse_args()
     print(args)
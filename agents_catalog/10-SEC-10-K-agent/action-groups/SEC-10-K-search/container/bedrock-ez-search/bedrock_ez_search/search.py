@@ -2,12 +2,21 @@
 Core semantic search functionality using Amazon Bedrock embeddings
 """
 
-import json
-from typing import Dict, List, Tuple, Union, Optional, Any
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Tuple, Union, Optional, Any
 
 import boto3
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import orjson
+from botocore.config import Config
+
+try:
+    import faiss
+except ImportError:  # optional dependency, see the "faiss" extra
+    faiss = None
 
 
 class SemanticSearch:
@@ -18,11 +27,19 @@ class SemanticSearch:
     searches against them using Amazon Bedrock embedding models.
     """
     
+    # Rows of a quantized index upcast and scored at a time, so a query only
+    # ever holds one float32 block of the index in memory
+    QUANTIZED_BLOCK_ROWS = 4096
+    
     def __init__(
         self, 
         model_id: str = "amazon.titan-embed-text-v1",
         region_name: Optional[str] = None,
         profile_name: Optional[str] = None,
+        max_workers: int = 16,
+        quantize: bool = False,
+        query_cache_size: int = 1024,
+        use_faiss: bool = False,
     ):
         """
         Initialize the semantic search engine.
@@ -31,7 +48,29 @@ class SemanticSearch:
             model_id: The Amazon Bedrock model ID to use for embeddings
             region_name: AWS region name (uses boto3 default if None)
             profile_name: AWS profile name (uses boto3 default if None)
+            max_workers: Maximum number of concurrent embedding requests
+                         made while indexing documents
+            quantize: If True, store the index as int8 vectors with a float32
+                      scale per vector, cutting index memory by 4x at the cost
+                      of a small loss of score precision
+            query_cache_size: Maximum number of query embeddings to keep in an
+                              LRU cache so repeated searches skip the Bedrock call
+            use_faiss: If True, search with a FAISS flat inner-product index,
+                       which fuses scoring and top-k selection in SIMD code.
+                       Requires the optional faiss dependency
+                       
+        Raises:
+            ImportError: If use_faiss is True but faiss is not installed
+            ValueError: If both quantize and use_faiss are True
         """
+        if use_faiss and faiss is None:
+            raise ImportError(
+                "use_faiss=True requires faiss. Install it with "
+                "'pip install bedrock-ez-search[faiss]'"
+            )
+        if use_faiss and quantize:
+            raise ValueError("quantize and use_faiss cannot be combined")
+        
         session_kwargs = {}
         if region_name:
             session_kwargs["region_name"] = region_name
@@ -39,11 +78,31 @@ class SemanticSearch:
             session_kwargs["profile_name"] = profile_name
             
         session = boto3.Session(**session_kwargs)
-        self.bedrock_runtime = session.client("bedrock-runtime")
+        # Size the connection pool to the indexing thread pool so every worker
+        # reuses a kept-alive TLS connection, and let adaptive retries absorb
+        # Bedrock throttling when indexing in parallel
+        self.bedrock_runtime = session.client(
+            "bedrock-runtime",
+            config=Config(
+                max_pool_connections=max(max_workers, 10),
+                tcp_keepalive=True,
+                read_timeout=30,
+                retries={"mode": "adaptive", "max_attempts": 10},
+            ),
+        )
         self.model_id = model_id
+        self.max_workers = max_workers
+        self.quantize = quantize
+        self.use_faiss = use_faiss
         
         self._documents = []
         self._embeddings = None
+        self._scales = None
+        self._faiss_index = None
+        
+        self.query_cache_size = query_cache_size
+        self._query_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._query_cache_lock = threading.Lock()
         
     def _get_embedding(self, text: str) -> np.ndarray:
         """
@@ -61,11 +120,38 @@ class SemanticSearch:
         
         response = self.bedrock_runtime.invoke_model(
             modelId=self.model_id,
-            body=json.dumps(request_body)
+            body=orjson.dumps(request_body)
         )
         
-        response_body = json.loads(response.get("body").read())
-        embedding = np.array(response_body.get("embedding"))
+        response_body = orjson.loads(response["body"].read())
+        embedding = np.asarray(response_body["embedding"], dtype=np.float32)
+        
+        return embedding
+    
+    def _get_query_embedding(self, query: str) -> np.ndarray:
+        """
+        Get embedding for a search query, using the LRU query cache.
+        
+        Args:
+            query: The search query
+            
+        Returns:
+            A numpy array containing the embedding vector
+        """
+        # The lock keeps the cache consistent when search_batch embeds queries
+        # on several threads; the Bedrock call itself happens outside it
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is not None:
+                self._query_cache.move_to_end(query)
+                return embedding
+        
+        embedding = self._get_embedding(query)
+        if self.query_cache_size > 0:
+            with self._query_cache_lock:
+                self._query_cache[query] = embedding
+                if len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
         
         return embedding
     
@@ -79,16 +165,108 @@ class SemanticSearch:
         Returns:
             A numpy array containing the embedding vectors
         """
-        # For simplicity, we'll process one at a time
-        # In a production system, you might want to batch these calls
-        embeddings = []
-        for text in texts:
-            embedding = self._get_embedding(text)
-            embeddings.append(embedding)
+        # Embedding calls are network-bound, so fan them out over a thread
+        # pool. executor.map preserves the input order of the texts.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            embeddings = list(executor.map(self._get_embedding, texts))
+        
+        return np.vstack(embeddings).astype(np.float32, copy=False)
+    
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        """
+        L2-normalize embedding vectors so cosine similarity is a dot product.
+        
+        Args:
+            embeddings: A 1-D vector or a 2-D matrix with one vector per row
+            
+        Returns:
+            A contiguous float32 copy of the input with unit-length rows
+        """
+        normalized = np.array(embeddings, dtype=np.float32, order="C")
+        norms = np.linalg.norm(normalized, axis=-1, keepdims=True)
+        # Leave all-zero vectors untouched rather than dividing by zero
+        norms[norms == 0] = 1.0
+        normalized /= norms
+        return normalized
+    
+    @staticmethod
+    def _quantize(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Symmetrically quantize embedding vectors to int8 with one scale per vector.
+        
+        Args:
+            embeddings: A 1-D vector or a 2-D matrix with one vector per row
+            
+        Returns:
+            A tuple of the int8 quantized values and the float32 scales such
+            that quantized * scales approximates the input
+        """
+        scales = np.abs(embeddings).max(axis=-1, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.rint(embeddings / scales).astype(np.int8)
+        return quantized, np.squeeze(scales, axis=-1).astype(np.float32)
+    
+    @staticmethod
+    def _is_normalized(embeddings: np.ndarray, atol: float = 1e-3) -> bool:
+        """
+        Check whether an embedding matrix already has float32 unit-length rows.
         
-        return np.vstack(embeddings)
+        Args:
+            embeddings: A 2-D matrix with one vector per row
+            atol: Absolute tolerance on each row norm
+            
+        Returns:
+            True if the matrix can be searched as-is without a normalized copy
+        """
+        if embeddings.dtype != np.float32 or embeddings.ndim != 2:
+            return False
+        # einsum computes the squared row norms without an (N, D) temporary
+        squared_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+        return bool(np.all(np.abs(squared_norms - 1.0) <= 2 * atol))
+    
+    @staticmethod
+    def _is_mapped_from(embeddings: np.ndarray, cache_path: Union[str, os.PathLike]) -> bool:
+        """
+        Check whether embeddings are memory-mapped from the file at cache_path.
+        
+        Args:
+            embeddings: The embeddings about to be saved
+            cache_path: The path passed to np.save, which appends .npy if missing
+            
+        Returns:
+            True if saving to cache_path would overwrite the mapped file
+        """
+        if not isinstance(embeddings, np.memmap) or embeddings.filename is None:
+            return False
+        cache_path = os.fspath(cache_path)
+        if not cache_path.endswith(".npy"):
+            cache_path += ".npy"
+        return os.path.exists(cache_path) and os.path.samefile(embeddings.filename, cache_path)
     
-    def index(self, documents: List[str], cache_path: Optional[str] = None, embeddings_file: Optional[str] = None) -> None:
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Get the unit-length embedding of a search query.
+        
+        Uses the same LRU query cache as search(), so embedding a query and
+        then searching for it makes a single Bedrock call.
+        
+        Args:
+            query: The search query
+            
+        Returns:
+            A float32 numpy array with unit L2 norm
+        """
+        return self._normalize(self._get_query_embedding(query))
+    
+    def index(
+        self,
+        documents: List[str],
+        cache_path: Optional[str] = None,
+        embeddings_file: Optional[Union[str, os.PathLike, BinaryIO]] = None,
+        prefetch: bool = False,
+        embeddings: Optional[np.ndarray] = None,
+    ) -> None:
         """
         Index a list of documents for semantic search.
         
@@ -96,35 +274,80 @@ class SemanticSearch:
             documents: List of text documents to index
             cache_path: Optional path to save embeddings as a .npy file
                         If provided, the embeddings will be saved to this location
-            embeddings_file: Optional path to load pre-computed embeddings from a .npy file
+                        as unit-length float16 rows, which halves the file size
+                        without affecting the ranking. Loading the file again
+                        upcasts it to float32
+            embeddings_file: Optional path or binary file-like object to load
+                            pre-computed embeddings from in .npy format
                             If provided, embeddings will be loaded from this file instead
-                            of computing them via the Bedrock API
+                            of computing them via the Bedrock API. A file on disk is
+                            memory-mapped and searched in place when it already
+                            holds unit-length float32 rows
+            prefetch: If True, page a memory-mapped embeddings file into the OS
+                      page cache on a background thread
+            embeddings: Optional pre-computed embeddings array, one row per document.
+                        Takes precedence over embeddings_file
                             
         Raises:
-            ValueError: If the number of embeddings loaded from file doesn't match
+            ValueError: If the number of pre-computed embeddings doesn't match
                        the number of documents
         """
         self._documents = documents
         
         # Load embeddings from file if embeddings_file is provided
-        if embeddings_file is not None:
-            loaded_embeddings = np.load(embeddings_file)
-            
+        if embeddings is None and embeddings_file is not None:
+            # Only files on disk can be memory-mapped; file-like objects such
+            # as an in-memory buffer are read directly
+            if isinstance(embeddings_file, (str, os.PathLike)):
+                embeddings = np.load(embeddings_file, mmap_mode="r")
+            else:
+                embeddings = np.load(embeddings_file)
+        
+        if embeddings is not None:
             # Validate that the number of embeddings matches the number of documents
-            if len(loaded_embeddings) != len(documents):
+            if len(embeddings) != len(documents):
                 raise ValueError(
-                    f"Number of embeddings in file ({len(loaded_embeddings)}) "
+                    f"Number of embeddings in file ({len(embeddings)}) "
                     f"doesn't match number of documents ({len(documents)})"
                 )
-                
-            self._embeddings = loaded_embeddings
         else:
             # Otherwise compute embeddings via the Bedrock API
-            self._embeddings = self._get_batch_embeddings(documents)
+            embeddings = self._get_batch_embeddings(documents)
+        
+        # Store unit-length float32 rows so search() is a single matrix-vector product.
+        # Float32 embeddings that were normalized ahead of time, e.g. when the file
+        # was built, are used without a copy. Anything else, including float16
+        # cache files, is upcast to a normalized float32 copy.
+        self._scales = None
+        self._faiss_index = None
+        is_normalized = self._is_normalized(embeddings)
+        normalized = embeddings if is_normalized else self._normalize(embeddings)
         
-        # Save embeddings to file if cache_path is provided
-        if cache_path is not None:
-            np.save(cache_path, self._embeddings)
+        # Save embeddings to file if cache_path is provided. A memory-mapped
+        # embeddings_file that is the cache file already holds the embeddings,
+        # and saving over it would truncate the data being written.
+        if cache_path is not None and not self._is_mapped_from(embeddings, cache_path):
+            np.save(cache_path, normalized.astype(np.float16))
+        
+        if self.quantize:
+            self._embeddings, self._scales = self._quantize(normalized)
+        elif is_normalized:
+            self._embeddings = (
+                embeddings
+                if isinstance(embeddings, np.memmap)
+                else np.ascontiguousarray(embeddings)
+            )
+            if prefetch and isinstance(embeddings, np.memmap):
+                threading.Thread(
+                    target=np.sum, args=(embeddings,), daemon=True
+                ).start()
+        else:
+            self._embeddings = normalized
+        
+        if self.use_faiss:
+            # Inner product over unit-length vectors is cosine similarity
+            self._faiss_index = faiss.IndexFlatIP(self._embeddings.shape[1])
+            self._faiss_index.add(np.ascontiguousarray(self._embeddings, dtype=np.float32))
     
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
@@ -140,25 +363,110 @@ class SemanticSearch:
         if self._embeddings is None or len(self._documents) == 0:
             raise ValueError("No documents have been indexed. Call index() first.")
         
-        # Get query embedding
-        query_embedding = self._get_embedding(query)
+        # Get the normalized query embedding; cosine similarity against the
+        # pre-normalized index is then a dot product
+        query_embedding = self.embed_query(query)
+        return self._search_embedding(query_embedding, top_k)
+    
+    def search_batch(
+        self, queries: List[str], top_k: int = 5
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search the indexed documents for several queries at once.
         
-        # Calculate cosine similarities
-        similarities = cosine_similarity(
-            query_embedding.reshape(1, -1), 
-            self._embeddings
-        )[0]
+        Titan embedding models take a single input text per request, so the
+        query embeddings are fetched concurrently on a thread pool rather than
+        one after another.
         
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        Args:
+            queries: The search queries
+            top_k: Number of top results to return per query
+            
+        Returns:
+            One list of results per query, in the same order as the queries
+        """
+        if self._embeddings is None or len(self._documents) == 0:
+            raise ValueError("No documents have been indexed. Call index() first.")
+        if not queries:
+            return []
+        
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(queries))
+        ) as executor:
+            query_embeddings = list(executor.map(self.embed_query, queries))
+        
+        return [
+            self._search_embedding(query_embedding, top_k)
+            for query_embedding in query_embeddings
+        ]
+    
+    def _score_quantized(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Score a normalized query against the int8 quantized index.
+        
+        numpy has no int8 matrix kernel, so the index is upcast to float32 in
+        blocks of QUANTIZED_BLOCK_ROWS rows and scored with a BLAS product into
+        a preallocated array, instead of materializing a full-size copy.
+        
+        Args:
+            query_embedding: Unit-length query embedding
+            
+        Returns:
+            The similarity of the query to every indexed document
+        """
+        query_quantized, query_scale = self._quantize(query_embedding)
+        query_quantized = query_quantized.astype(np.float32)
+        similarities = np.empty(len(self._embeddings), dtype=np.float32)
+        for start in range(0, len(self._embeddings), self.QUANTIZED_BLOCK_ROWS):
+            stop = start + self.QUANTIZED_BLOCK_ROWS
+            np.matmul(
+                self._embeddings[start:stop].astype(np.float32),
+                query_quantized,
+                out=similarities[start:stop],
+            )
+        similarities *= self._scales * query_scale
+        return similarities
+    
+    def _search_embedding(
+        self, query_embedding: np.ndarray, top_k: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Rank the indexed documents against a normalized query embedding.
+        
+        Args:
+            query_embedding: Unit-length query embedding
+            top_k: Number of top results to return
+            
+        Returns:
+            List of dictionaries containing document text and similarity score
+        """
+        top_k = min(top_k, len(self._documents))
+        if top_k <= 0:
+            return []
+        
+        if self._faiss_index is not None:
+            # FAISS returns the top-k scores and indices already sorted
+            top_scores, top_indices = self._faiss_index.search(
+                query_embedding.reshape(1, -1), top_k
+            )
+            top_scores, top_indices = top_scores[0], top_indices[0]
+        else:
+            if self._scales is not None:
+                similarities = self._score_quantized(query_embedding)
+            else:
+                similarities = self._embeddings @ query_embedding
+            
+            # Get top-k indices: partial selection in O(N), then sort only those k
+            top_indices = np.argpartition(similarities, -top_k)[-top_k:]
+            top_indices = top_indices[np.argsort(-similarities[top_indices])]
+            top_scores = similarities[top_indices]
         
-        # Prepare results
-        results = []
-        for idx in top_indices:
-            results.append({
-                "document": self._documents[idx],
-                "score": float(similarities[idx]),
-                "index": int(idx)
-            })
+        # Prepare results, converting the score and index columns in bulk
+        indices = top_indices.tolist()
+        scores = top_scores.tolist()
+        documents = [self._documents[idx] for idx in indices]
         
-        return results
+        return [
+            {"document": document, "score": score, "index": idx}
+            for document, score, idx in zip(documents, scores, indices)
+        ]
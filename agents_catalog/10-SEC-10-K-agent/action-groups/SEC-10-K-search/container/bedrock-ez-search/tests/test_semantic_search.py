@@ -2,7 +2,10 @@
 Tests for the SemanticSearch class
 """
 
+import io
 import os
+import tempfile
+import tracemalloc
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
 import numpy as np
@@ -34,7 +37,12 @@ class TestSemanticSearch(unittest.TestCase):
             region_name="ap-northeast-1 ",
             profile_name="test-profile"
         )
-        mock_session.return_value.client.assert_called_once_with("bedrock-runtime")
+        mock_session.return_value.client.assert_called_once()
+        args, kwargs = mock_session.return_value.client.call_args
+        self.assertEqual(args[0], "bedrock-runtime")
+        self.assertEqual(kwargs["config"].retries["mode"], "adaptive")
+        self.assertEqual(kwargs["config"].max_pool_connections, 16)
+        self.assertTrue(kwargs["config"].tcp_keepalive)
     
     @patch('boto3.Session')
     def test_get_embedding(self, mock_session):
@@ -52,9 +60,67 @@ class TestSemanticSearch(unittest.TestCase):
         search = SemanticSearch()
         embedding = search._get_embedding("test text")
         
-        np.testing.assert_array_equal(embedding, np.array([0.1, 0.2, 0.3, 0.4]))
+        self.assertEqual(embedding.dtype, np.float32)
+        np.testing.assert_array_equal(embedding, np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32))
         mock_client.invoke_model.assert_called_once()
     
+    @patch('boto3.Session')
+    def test_query_embedding_cache(self, mock_session):
+        """Test that repeated queries reuse cached embeddings"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch(query_cache_size=2)
+        
+        with patch.object(search, '_get_embedding') as mock_get_embedding:
+            mock_get_embedding.side_effect = lambda text: np.array([len(text), 1.0])
+            
+            search._get_query_embedding("a")
+            search._get_query_embedding("a")
+            self.assertEqual(mock_get_embedding.call_count, 1)
+            
+            # "bb" and "ccc" push "a" out of the two-entry cache
+            search._get_query_embedding("bb")
+            search._get_query_embedding("ccc")
+            search._get_query_embedding("a")
+            self.assertEqual(mock_get_embedding.call_count, 4)
+            self.assertEqual(list(search._query_cache), ["ccc", "a"])
+    
+    @patch('boto3.Session')
+    def test_embed_query(self, mock_session):
+        """Test that embed_query returns a cached unit-length embedding"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        
+        with patch.object(search, '_get_embedding') as mock_get_embedding:
+            mock_get_embedding.return_value = np.array([3.0, 4.0], dtype=np.float32)
+            
+            embedding = search.embed_query("test query")
+            search.embed_query("test query")
+            
+            np.testing.assert_allclose(embedding, [0.6, 0.8], rtol=1e-6)
+            mock_get_embedding.assert_called_once_with("test query")
+    
+    @patch('boto3.Session')
+    def test_get_batch_embeddings_preserves_order(self, mock_session):
+        """Test that concurrent batch embedding keeps the input order"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch(max_workers=4)
+        texts = [f"Document {i}" for i in range(20)]
+        
+        with patch.object(search, '_get_embedding') as mock_get_embedding:
+            mock_get_embedding.side_effect = lambda text: np.array(
+                [float(text.split()[-1]), 1.0]
+            )
+            embeddings = search._get_batch_embeddings(texts)
+        
+        np.testing.assert_array_equal(embeddings[:, 0], np.arange(20))
+        self.assertEqual(mock_get_embedding.call_count, 20)
+    
     @patch('boto3.Session')
     def test_index_with_cache(self, mock_session):
         """Test indexing with cache functionality"""
@@ -73,10 +139,11 @@ class TestSemanticSearch(unittest.TestCase):
         # Mock the _get_embedding method to return controlled values
         with patch.object(search, '_get_embedding') as mock_get_embedding:
             # For document embeddings
-            mock_get_embedding.side_effect = [
-                np.array([0.9, 0.1, 0.1, 0.1]),  # doc 1
-                np.array([0.1, 0.9, 0.1, 0.1]),  # doc 2
-            ]
+            # Keyed by text since embeddings are fetched concurrently
+            mock_get_embedding.side_effect = {
+                "Document 1": np.array([0.9, 0.1, 0.1, 0.1]),  # doc 1
+                "Document 2": np.array([0.1, 0.9, 0.1, 0.1]),  # doc 2
+            }.get
             
             # Mock np.save to verify it's called with correct arguments
             with patch('numpy.save') as mock_save:
@@ -90,13 +157,13 @@ class TestSemanticSearch(unittest.TestCase):
                 mock_save.assert_called_once()
                 args, _ = mock_save.call_args
                 self.assertEqual(args[0], "test_embeddings.npy")
-                np.testing.assert_array_equal(
-                    args[1], 
-                    np.vstack([
-                        np.array([0.9, 0.1, 0.1, 0.1]),
-                        np.array([0.1, 0.9, 0.1, 0.1])
-                    ])
-                )
+                expected = np.vstack([
+                    np.array([0.9, 0.1, 0.1, 0.1]),
+                    np.array([0.1, 0.9, 0.1, 0.1])
+                ])
+                expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+                np.testing.assert_allclose(args[1], expected, atol=1e-3)
+                self.assertEqual(args[1].dtype, np.float16)
     
     @patch('boto3.Session')
     def test_search(self, mock_session):
@@ -116,11 +183,12 @@ class TestSemanticSearch(unittest.TestCase):
         # Mock the _get_embedding method to return controlled values
         with patch.object(search, '_get_embedding') as mock_get_embedding:
             # For document embeddings
-            mock_get_embedding.side_effect = [
-                np.array([0.9, 0.1, 0.1, 0.1]),  # doc 1 - less similar
-                np.array([0.1, 0.9, 0.1, 0.1]),  # doc 2 - most similar
-                np.array([0.5, 0.5, 0.1, 0.1]),  # doc 3 - medium similar
-            ]
+            # Keyed by text since embeddings are fetched concurrently
+            mock_get_embedding.side_effect = {
+                "Document 1": np.array([0.9, 0.1, 0.1, 0.1]),  # doc 1 - less similar
+                "Document 2": np.array([0.1, 0.9, 0.1, 0.1]),  # doc 2 - most similar
+                "Document 3": np.array([0.5, 0.5, 0.1, 0.1]),  # doc 3 - medium similar
+            }.get
             
             # Index the documents
             search.index([
@@ -142,6 +210,155 @@ class TestSemanticSearch(unittest.TestCase):
             self.assertEqual(results[0]["document"], "Document 2")
             self.assertGreater(results[0]["score"], results[1]["score"])  # First result should have higher score
     
+    @patch('boto3.Session')
+    def test_search_top_k_ordering(self, mock_session):
+        """Test that search returns the top_k results in descending score order"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        documents = [f"Document {i}" for i in range(10)]
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(10, 4))
+        query = rng.normal(size=4)
+        
+        with patch('numpy.load', return_value=embeddings):
+            search.index(documents, embeddings_file="embeddings.npy")
+        
+        with patch.object(search, '_get_embedding', return_value=query):
+            results = search.search("test query", top_k=3)
+            all_results = search.search("test query", top_k=50)
+        
+        normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        expected = np.argsort(-(normalized @ query))
+        self.assertEqual([r["index"] for r in results], expected[:3].tolist())
+        self.assertEqual([r["index"] for r in all_results], expected.tolist())
+    
+    @patch('boto3.Session')
+    def test_search_batch(self, mock_session):
+        """Test that search_batch matches per-query search results in query order"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        documents = [f"Document {i}" for i in range(10)]
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(10, 4))
+        query_embeddings = {f"query {i}": rng.normal(size=4) for i in range(5)}
+        
+        with patch('numpy.load', return_value=embeddings):
+            search.index(documents, embeddings_file="embeddings.npy")
+        
+        with patch.object(search, '_get_embedding', side_effect=query_embeddings.get):
+            batch_results = search.search_batch(list(query_embeddings), top_k=3)
+            single_results = [search.search(q, top_k=3) for q in query_embeddings]
+        
+        self.assertEqual(batch_results, single_results)
+        self.assertEqual(search.search_batch([], top_k=3), [])
+    
+    @patch('boto3.Session')
+    def test_search_quantized(self, mock_session):
+        """Test search against an int8 quantized index"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch(quantize=True)
+        embeddings = np.array([
+            [0.9, 0.1, 0.1, 0.1],
+            [0.1, 0.9, 0.1, 0.1],
+            [0.5, 0.5, 0.1, 0.1]
+        ])
+        
+        with patch('numpy.load', return_value=embeddings):
+            search.index(
+                ["Document 1", "Document 2", "Document 3"],
+                embeddings_file="embeddings.npy"
+            )
+        
+        self.assertEqual(search._embeddings.dtype, np.int8)
+        self.assertEqual(search._scales.shape, (3,))
+        
+        with patch.object(search, '_get_embedding', return_value=np.array([0.1, 0.9, 0.1, 0.1])):
+            results = search.search("test query", top_k=3)
+        
+        self.assertEqual([r["index"] for r in results], [1, 2, 0])
+        self.assertAlmostEqual(results[0]["score"], 1.0, places=2)
+    
+    @patch('boto3.Session')
+    def test_search_quantized_scores_in_blocks(self, mock_session):
+        """Test that a quantized search never holds a full-size copy of the index"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(20000, 64)).astype(np.float32)
+        query = rng.normal(size=64).astype(np.float32)
+        documents = [f"Document {i}" for i in range(len(embeddings))]
+        
+        search = SemanticSearch(quantize=True)
+        search.QUANTIZED_BLOCK_ROWS = 1024
+        search.index(documents, embeddings=embeddings)
+        with patch.object(search, '_get_embedding', return_value=query):
+            search.search("warm up", top_k=5)
+            tracemalloc.start()
+            try:
+                results = search.search("test query", top_k=5)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        
+        # A full float32 or int32 copy of the index would be 20000 * 64 * 4 bytes;
+        # the blocked path needs one 1024-row block plus the score array
+        self.assertLess(peak, embeddings.nbytes // 4)
+        
+        # Same ranking as an exact integer product over the whole index
+        query_quantized, query_scale = search._quantize(search._normalize(query))
+        expected = (
+            search._embeddings.astype(np.int64) @ query_quantized.astype(np.int64)
+        ) * (search._scales * query_scale)
+        self.assertEqual(
+            [r["index"] for r in results],
+            np.argsort(-expected)[:5].tolist()
+        )
+    
+    @patch('boto3.Session')
+    def test_search_with_faiss(self, mock_session):
+        """Test that the FAISS index returns the same ranking as the NumPy path"""
+        try:
+            import faiss  # noqa: F401
+        except ImportError:
+            self.skipTest("faiss is not installed")
+        
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        documents = [f"Document {i}" for i in range(10)]
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(10, 4))
+        query = rng.normal(size=4)
+        
+        rankings = []
+        for use_faiss in (False, True):
+            search = SemanticSearch(use_faiss=use_faiss)
+            with patch('numpy.load', return_value=embeddings):
+                search.index(documents, embeddings_file="embeddings.npy")
+            with patch.object(search, '_get_embedding', return_value=query):
+                rankings.append(search.search("test query", top_k=3))
+        
+        self.assertEqual(
+            [r["index"] for r in rankings[0]],
+            [r["index"] for r in rankings[1]]
+        )
+        for numpy_result, faiss_result in zip(*rankings):
+            self.assertAlmostEqual(numpy_result["score"], faiss_result["score"], places=5)
+    
+    @patch('boto3.Session')
+    def test_use_faiss_without_faiss_installed(self, mock_session):
+        """Test that requesting FAISS without it installed raises ImportError"""
+        with patch('bedrock_ez_search.search.faiss', None):
+            with self.assertRaises(ImportError):
+                SemanticSearch(use_faiss=True)
+    
     @patch('boto3.Session')
     def test_index_without_cache(self, mock_session):
         """Test indexing without cache functionality"""
@@ -160,10 +377,11 @@ class TestSemanticSearch(unittest.TestCase):
         # Mock the _get_embedding method to return controlled values
         with patch.object(search, '_get_embedding') as mock_get_embedding:
             # For document embeddings
-            mock_get_embedding.side_effect = [
-                np.array([0.9, 0.1, 0.1, 0.1]),  # doc 1
-                np.array([0.1, 0.9, 0.1, 0.1]),  # doc 2
-            ]
+            # Keyed by text since embeddings are fetched concurrently
+            mock_get_embedding.side_effect = {
+                "Document 1": np.array([0.9, 0.1, 0.1, 0.1]),  # doc 1
+                "Document 2": np.array([0.1, 0.9, 0.1, 0.1]),  # doc 2
+            }.get
             
             # Mock np.save to verify it's not called when cache_path is None
             with patch('numpy.save') as mock_save:
@@ -198,17 +416,117 @@ class TestSemanticSearch(unittest.TestCase):
                 )
                 
                 # Verify np.load was called with the correct path
-                mock_load.assert_called_once_with("pre_computed_embeddings.npy")
+                mock_load.assert_called_once_with("pre_computed_embeddings.npy", mmap_mode="r")
                 
                 # Verify _get_batch_embeddings was not called
                 mock_get_batch.assert_not_called()
                 
-                # Verify the embeddings were properly set
-                np.testing.assert_array_equal(search._embeddings, mock_embeddings)
+                # Verify the embeddings were stored as unit-length float32 rows
+                self.assertEqual(search._embeddings.dtype, np.float32)
+                np.testing.assert_allclose(
+                    search._embeddings,
+                    mock_embeddings / np.linalg.norm(mock_embeddings, axis=1, keepdims=True),
+                    rtol=1e-6
+                )
                 
                 # Verify the documents were properly set
                 self.assertEqual(search._documents, ["Document 1", "Document 2"])
     
+    @patch('boto3.Session')
+    def test_index_with_normalized_embeddings_file_is_memory_mapped(self, mock_session):
+        """Test that a normalized float32 embeddings file is searched in place"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        embeddings = np.array([
+            [0.6, 0.8, 0.0, 0.0],
+            [0.0, 0.0, 0.8, 0.6]
+        ], dtype=np.float32)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            embeddings_file = os.path.join(tmp_dir, "embeddings.npy")
+            np.save(embeddings_file, embeddings)
+            
+            search.index(["Document 1", "Document 2"], embeddings_file=embeddings_file)
+            
+            self.assertIsInstance(search._embeddings, np.memmap)
+            np.testing.assert_array_equal(search._embeddings, embeddings)
+            
+            with patch.object(search, '_get_embedding', return_value=np.array([0.0, 0.0, 1.0, 0.0])):
+                results = search.search("test query", top_k=1)
+            
+            self.assertEqual(results[0]["document"], "Document 2")
+            del search
+    
+    @patch('boto3.Session')
+    def test_index_with_in_memory_embeddings_file(self, mock_session):
+        """Test loading embeddings from a file-like object"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        embeddings = np.array([
+            [0.6, 0.8, 0.0, 0.0],
+            [0.0, 0.0, 0.8, 0.6]
+        ], dtype=np.float32)
+        buffer = io.BytesIO()
+        np.save(buffer, embeddings)
+        buffer.seek(0)
+        
+        search.index(["Document 1", "Document 2"], embeddings_file=buffer)
+        
+        self.assertNotIsInstance(search._embeddings, np.memmap)
+        np.testing.assert_array_equal(search._embeddings, embeddings)
+    
+    @patch('boto3.Session')
+    def test_index_with_embeddings_array(self, mock_session):
+        """Test indexing with a pre-computed embeddings array"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        embeddings = np.array([
+            [3.0, 4.0, 0.0, 0.0],
+            [0.0, 0.0, 0.8, 0.6]
+        ])
+        
+        with patch.object(search, '_get_batch_embeddings') as mock_get_batch:
+            with patch('numpy.load') as mock_load:
+                search.index(
+                    ["Document 1", "Document 2"],
+                    embeddings_file="ignored.npy",
+                    embeddings=embeddings
+                )
+                
+                mock_load.assert_not_called()
+                mock_get_batch.assert_not_called()
+        
+        np.testing.assert_allclose(
+            search._embeddings,
+            [[0.6, 0.8, 0.0, 0.0], [0.0, 0.0, 0.8, 0.6]],
+            rtol=1e-6
+        )
+        
+        with self.assertRaises(ValueError):
+            search.index(["Document 1"], embeddings=embeddings)
+    
+    @patch('boto3.Session')
+    def test_index_with_normalized_embeddings_array_is_not_copied(self, mock_session):
+        """Test that pre-normalized float32 embeddings are stored without a copy"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        search = SemanticSearch()
+        embeddings = np.array([
+            [0.6, 0.8, 0.0, 0.0],
+            [0.0, 0.0, 0.8, 0.6]
+        ], dtype=np.float32)
+        
+        search.index(["Document 1", "Document 2"], embeddings=embeddings)
+        
+        self.assertTrue(np.shares_memory(search._embeddings, embeddings))
+    
     @patch('boto3.Session')
     def test_index_with_embeddings_file_and_cache(self, mock_session):
         """Test loading embeddings from file and saving to cache"""
@@ -237,7 +555,7 @@ class TestSemanticSearch(unittest.TestCase):
                     )
                     
                     # Verify np.load was called with the correct path
-                    mock_load.assert_called_once_with("pre_computed_embeddings.npy")
+                    mock_load.assert_called_once_with("pre_computed_embeddings.npy", mmap_mode="r")
                     
                     # Verify _get_batch_embeddings was not called
                     mock_get_batch.assert_not_called()
@@ -246,7 +564,65 @@ class TestSemanticSearch(unittest.TestCase):
                     mock_save.assert_called_once()
                     args, _ = mock_save.call_args
                     self.assertEqual(args[0], "cached_embeddings.npy")
-                    np.testing.assert_array_equal(args[1], mock_embeddings)
+                    np.testing.assert_allclose(
+                        args[1],
+                        mock_embeddings / np.linalg.norm(mock_embeddings, axis=1, keepdims=True),
+                        atol=1e-3
+                    )
+                    self.assertEqual(args[1].dtype, np.float16)
+    
+    @patch('boto3.Session')
+    def test_index_with_float16_cache_file(self, mock_session):
+        """Test that a float16 cache file is upcast to float32 when loaded again"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(200, 64)).astype(np.float32)
+        documents = [f"Document {i}" for i in range(len(embeddings))]
+        query = rng.normal(size=64).astype(np.float32)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "embeddings.npy")
+            
+            search = SemanticSearch()
+            search.index(documents, cache_path=path, embeddings=embeddings)
+            self.assertEqual(np.load(path).dtype, np.float16)
+            with patch.object(search, '_get_embedding', return_value=query):
+                expected = search.search("test query", top_k=5)
+            
+            cached = SemanticSearch()
+            cached.index(documents, embeddings_file=path)
+            self.assertEqual(cached._embeddings.dtype, np.float32)
+            with patch.object(cached, '_get_embedding', return_value=query):
+                results = cached.search("test query", top_k=5)
+        
+        for result, exp in zip(results, expected):
+            self.assertAlmostEqual(result["score"], exp["score"], places=2)
+    
+    @patch('boto3.Session')
+    def test_index_with_embeddings_file_as_cache_path(self, mock_session):
+        """Test that caching to the memory-mapped source file keeps its data intact"""
+        mock_client = MagicMock()
+        mock_session.return_value.client.return_value = mock_client
+        
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(500, 256)).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        documents = [f"Document {i}" for i in range(len(embeddings))]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "embeddings.npy")
+            np.save(path, embeddings)
+            
+            search = SemanticSearch()
+            search.index(documents, embeddings_file=path, cache_path=path)
+            
+            np.testing.assert_array_equal(np.load(path), embeddings)
+            with patch.object(search, '_get_embedding', return_value=embeddings[42]):
+                results = search.search("test query", top_k=1)
+            self.assertEqual(results[0]["index"], 42)
+            del search
 
 
 if __name__ == '__main__':
@@ -4,14 +4,20 @@
 from bedrock_ez_search import SemanticSearch
 
 import boto3
+from botocore.config import Config
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
 import json
 import logging
+import numpy as np
 import os
 from pathlib import Path
 from rapidfuzz import process, fuzz, utils
-import re
 import requests
 from sec_edgar_api import EdgarClient
+import time
 from typing import Dict, Optional, List
 import urllib
 import warnings
@@ -32,21 +38,88 @@ DEFAULT_SCORE_CUTOFF = (
     80  # Define constant for default score cutoff for cik fuzzy matching
 )
 
+TAGS_CACHE_ENABLED = (
+    os.environ.get("TAGS_CACHE_ENABLED", "true").strip().lower() == "true"
+)
+TAGS_CACHE_MAX_SIZE = int(os.environ.get("TAGS_CACHE_MAX_SIZE", "256"))
+TAGS_CACHE_TTL_SECONDS = int(os.environ.get("TAGS_CACHE_TTL_SECONDS", "3600"))
+
 # amazonq-ignore-next-line
 edgar = EdgarClient(
     user_agent=os.environ.get("USER_AGENT", "AWS HCLS AGENTS").strip().upper()
 )
 
-s3 = boto3.client("s3")
-s3.download_file(
-    "5d1a4b76751b4c8a994ce96bafd91ec9", "us-gaap/embeddings.npy", "/tmp/embeddings.npy"
-)
-s3.download_file(
-    "5d1a4b76751b4c8a994ce96bafd91ec9",
-    "us-gaap/descriptions.csv",
-    "/tmp/descriptions.csv",
+INDEX_BUCKET = "5d1a4b76751b4c8a994ce96bafd91ec9"
+
+s3 = boto3.client(
+    "s3",
+    config=Config(
+        max_pool_connections=10,
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+    ),
 )
 
+
+def fetch_index_object(key: str) -> bytes:
+    """
+    Read an index file from the index bucket into memory.
+
+    Args:
+        key (str): The S3 object key
+
+    Returns:
+        bytes: The object contents
+    """
+    return s3.get_object(Bucket=INDEX_BUCKET, Key=key)["Body"].read()
+
+
+# Index state, populated once per container by _init()
+_INITIALIZED = False
+_AVAILABLE_FACTS = None
+_SEARCH = None
+
+# Company tickers parsed from cik-ref.json, cached across warm invocations
+_COMPANY_TICKERS = None
+_CHOICES = None
+_CHOICES_NORM = None
+_VALUES = None
+
+##############################################################################
+# find_relevant_tags response cache
+##############################################################################
+
+# Responses kept across warm invocations, keyed by the normalized query, with
+# TTL expiry and LRU eviction
+_RELEVANT_TAGS_CACHE = OrderedDict()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize case and whitespace so trivially different queries share a cache entry"""
+    return " ".join(query.lower().split())
+
+
+def get_cached_tags(key: str) -> Optional[str]:
+    """Return the cached response for key, or None if missing or expired"""
+    entry = _RELEVANT_TAGS_CACHE.get(key)
+    if entry is None:
+        return None
+    response, expires = entry
+    if expires <= time.monotonic():
+        del _RELEVANT_TAGS_CACHE[key]
+        return None
+    _RELEVANT_TAGS_CACHE.move_to_end(key)
+    return response
+
+
+def put_cached_tags(key: str, response: str) -> None:
+    """Cache a response, evicting the least recently used entries beyond the max size"""
+    _RELEVANT_TAGS_CACHE[key] = (response, time.monotonic() + TAGS_CACHE_TTL_SECONDS)
+    _RELEVANT_TAGS_CACHE.move_to_end(key)
+    while len(_RELEVANT_TAGS_CACHE) > TAGS_CACHE_MAX_SIZE:
+        _RELEVANT_TAGS_CACHE.popitem(last=False)
+
+
 ##############################################################################
 # Get CIK for company name
 ##############################################################################
@@ -70,27 +143,34 @@ def get_cik(
         FileNotFoundError: If the data_file doesn't exist
         json.JSONDecodeError: If the data_file contains invalid JSON
     """
-    try:
-        # amazonq-ignore-next-line
-        with open(data_file, "r", encoding="utf-8") as f:
-            company_tickers = json.load(f)
-    except IOError as e:
-        logger.error(f"Error opening file {data_file}: {str(e)}")
-        return None
-
-    if not company_tickers:
+    global _COMPANY_TICKERS, _CHOICES, _CHOICES_NORM, _VALUES
+
+    if _COMPANY_TICKERS is None:
+        try:
+            # amazonq-ignore-next-line
+            with open(data_file, "r", encoding="utf-8") as f:
+                company_tickers = json.load(f)
+        except IOError as e:
+            logger.error(f"Error opening file {data_file}: {str(e)}")
+            return None
+
+        _VALUES = tuple(company_tickers.values())
+        _CHOICES = [company.get("title", "") for company in _VALUES]
+        # Normalize the choices once instead of on every comparison
+        _CHOICES_NORM = [utils.default_process(title) for title in _CHOICES]
+        _COMPANY_TICKERS = company_tickers
+
+    if not _COMPANY_TICKERS:
         return None
 
-    choices = [company.get("title", "") for company in company_tickers.values()]
-
     match = process.extractOne(
-        query,
-        choices,
+        utils.default_process(query),
+        _CHOICES_NORM,
         scorer=fuzz.WRatio,
-        processor=utils.default_process,
+        processor=None,
         score_cutoff=score_cutoff,
     )
-    return list(company_tickers.values())[match[2]] if match else None
+    return _VALUES[match[2]] if match else None
 
 
 ##############################################################################
@@ -124,41 +204,108 @@ def get_cik(
 ##############################################################################
 
 
-def get_relevant_tags(
-    query: str,
-    top_k: int = 5,
-    index_descriptions: Path = "/tmp/descriptions.csv",
-    index_embeddings: Path = "/tmp/embeddings.npy",
-) -> Dict:
-    with open(index_descriptions, "r") as f:
-        pattern = r"^([^,]+),([^,]+),(.+)$"
-        available_facts = []
-        for line in f:
-            match = re.match(pattern, line.strip())
-            if match:
-                taxonomy, tag, description = match.groups()
-                available_facts.append(
-                    {
-                        "taxonomy": taxonomy,
-                        "tag": tag,
-                        "description": description,
-                    }
-                )
-            else:
-                logger.error(f"Error parsing line: {line.strip()}")
+def load_available_facts(index_descriptions: str) -> List[Dict]:
+    """
+    Parse the taxonomy, tag, and description of each indexed fact.
 
+    Args:
+        index_descriptions (str): Contents of the descriptions CSV file
+
+    Returns:
+        List[Dict]: One dictionary per fact, in index order
+    """
+    available_facts = []
+    for row in csv.reader(io.StringIO(index_descriptions)):
+        if len(row) >= 3 and row[0] and row[1]:
+            # Descriptions may contain unquoted commas, so keep the remainder whole
+            taxonomy, tag, *description = row
+            available_facts.append(
+                {
+                    "taxonomy": taxonomy,
+                    "tag": tag,
+                    "description": ",".join(description).strip(),
+                }
+            )
+        elif row:
+            logger.error(f"Error parsing line: {','.join(row)}")
+    return available_facts
+
+
+def build_tag_search(
+    available_facts: List[Dict], index_embeddings: np.ndarray
+) -> Optional[SemanticSearch]:
+    """
+    Build the semantic search index over the fact descriptions.
+
+    Args:
+        available_facts (List[Dict]): Facts returned by load_available_facts
+        index_embeddings (np.ndarray): Pre-computed description embeddings
+
+    Returns:
+        Optional[SemanticSearch]: The search index, or None if it could not be built
+    """
     try:
         search = SemanticSearch(
             model_id="amazon.titan-embed-text-v2:0",  # Using v2 model
         )
         search.index(
             [i["description"] for i in available_facts if i["description"] is not None],
-            embeddings_file=index_embeddings,
+            embeddings=index_embeddings,
         )
-        hits = search.search(query, top_k=top_k)
+        return search
+    except Exception as e:
+        logger.error(f"Error building search index: {str(e)}")
+        return None
+
+
+def _init() -> None:
+    """
+    Load the index files and build the tag search index, once per container.
+
+    Runs during the Lambda init phase, so a SnapStart snapshot captures the
+    loaded index, and otherwise on the first invocation, so importing the
+    module (e.g. in tests) does not read from S3.
+    """
+    global _INITIALIZED, _AVAILABLE_FACTS, _SEARCH
+
+    if _INITIALIZED:
+        return
+
+    # Read the index files concurrently and straight into memory, so cold start
+    # waits for the slowest object only and nothing is written to /tmp
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        embeddings_fetch = executor.submit(fetch_index_object, "us-gaap/embeddings.npy")
+        descriptions_fetch = executor.submit(
+            fetch_index_object, "us-gaap/descriptions.csv"
+        )
+        index_embeddings = embeddings_fetch.result()
+        index_descriptions = descriptions_fetch.result().decode("utf-8")
+
+    # Parse the descriptions and build the index once per container so warm
+    # invocations only embed the query and search
+    _AVAILABLE_FACTS = load_available_facts(index_descriptions)
+    index_embeddings = np.load(io.BytesIO(index_embeddings))
+    _SEARCH = build_tag_search(_AVAILABLE_FACTS, index_embeddings)
+    # Leave a failed build to be retried by the next invocation instead of
+    # serving "index is not available" for the lifetime of the container
+    _INITIALIZED = _SEARCH is not None
+
+
+# Initialize eagerly during the Lambda init phase (on-demand, provisioned
+# concurrency, or SnapStart), and lazily from the handlers anywhere else
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE"):
+    _init()
+
+
+def get_relevant_tags(query: str, top_k: int = 5) -> Dict:
+    if _SEARCH is None:
+        return {"TEXT": {"body": "Error during search: search index is not available"}}
+
+    try:
+        hits = _SEARCH.search(query, top_k=top_k)
 
         # Get the records in available_facts that correspond to the index values for the records in search_results
-        search_results = [available_facts[i["index"]] for i in hits]
+        search_results = [_AVAILABLE_FACTS[i["index"]] for i in hits]
 
         return search_results
     except Exception as e:
@@ -166,6 +313,50 @@ def get_relevant_tags(
         return {"TEXT": {"body": f"Error during search: {str(e)}"}}
 
 
+def get_relevant_tags_batch(queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+    """
+    Find the relevant tags for several queries, embedding them concurrently.
+
+    Args:
+        queries (List[str]): The queries to search for
+        top_k (int): Number of tags to return per query
+
+    Returns:
+        List[List[Dict]]: The relevant facts for each query, in query order
+    """
+    if _SEARCH is None:
+        raise ValueError("search index is not available")
+
+    return [
+        [_AVAILABLE_FACTS[i["index"]] for i in hits]
+        for hits in _SEARCH.search_batch(queries, top_k=top_k)
+    ]
+
+
+def parse_queries(query: str) -> List[str]:
+    """
+    Split a query parameter holding a JSON list of strings into its queries.
+
+    Args:
+        query (str): The query parameter value
+
+    Returns:
+        List[str]: The individual queries, or just the query itself
+    """
+    if query.lstrip().startswith("["):
+        try:
+            queries = json.loads(query)
+        except json.JSONDecodeError:
+            return [query]
+        if (
+            isinstance(queries, list)
+            and queries
+            and all(isinstance(q, str) and q for q in queries)
+        ):
+            return queries
+    return [query]
+
+
 def format_relevant_tag_response(response: Dict) -> Dict:
     """
     Format the get relevant tags response into a human-readable string.
@@ -198,12 +389,11 @@ def handle_find_relevant_tags(parameters) -> List[Dict]:
         dict: A dictionary containing the response body.
     """
 
+    _init()
+
+    params = {p["name"]: p.get("value") for p in parameters}
     required_params = ["query"]
-    missing_params = [
-        param
-        for param in required_params
-        if not next((p["value"] for p in parameters if p["name"] == param), None)
-    ]
+    missing_params = [param for param in required_params if not params.get(param)]
 
     if missing_params:
         return {
@@ -212,14 +402,33 @@ def handle_find_relevant_tags(parameters) -> List[Dict]:
             }
         }
 
-    query = next(
-        (param["value"] for param in parameters if param["name"] == "query"),
-        None,
-    )
+    query = params["query"]
+    queries = parse_queries(query)
 
     try:
+        if len(queries) > 1:
+            relevant_tags = get_relevant_tags_batch(queries, top_k=5)
+            formatted_response = json.dumps(
+                [
+                    {"query": q, "tags": json.loads(format_relevant_tag_response(tags))}
+                    for q, tags in zip(queries, relevant_tags)
+                ],
+                separators=(",", ":"),
+            )
+            return {"TEXT": {"body": formatted_response}}
+
+        # Repeated questions reuse the previous answer without calling Bedrock
+        cache_key = normalize_query(query)
+        if TAGS_CACHE_ENABLED:
+            cached_response = get_cached_tags(cache_key)
+            if cached_response is not None:
+                logger.debug("find_relevant_tags: cache hit")
+                return {"TEXT": {"body": cached_response}}
+
         relevant_tags = get_relevant_tags(query, top_k=5)
         formatted_response = format_relevant_tag_response(relevant_tags)
+        if TAGS_CACHE_ENABLED and isinstance(relevant_tags, list):
+            put_cached_tags(cache_key, formatted_response)
         return {"TEXT": {"body": formatted_response}}
     except Exception as e:
         logger.error(f"Error in find_relevant_tags: {str(e)}")
@@ -292,12 +501,9 @@ def format_concept_response(response: Dict) -> Dict:
 
 
 def handle_get_company_concept(parameters: Dict):
+    params = {p["name"]: p.get("value") for p in parameters}
     required_params = ["company_name", "tag"]
-    missing_params = [
-        param
-        for param in required_params
-        if not next((p["value"] for p in parameters if p["name"] == param), None)
-    ]
+    missing_params = [param for param in required_params if not params.get(param)]
 
     if missing_params:
         return {
@@ -306,12 +512,8 @@ def handle_get_company_concept(parameters: Dict):
             }
         }
 
-    company_name = next(
-        (param["value"] for param in parameters if param["name"] == "company_name"),
-        None,
-    )
-
-    tag = next((param["value"] for param in parameters if param["name"] == "tag"), None)
+    company_name = params["company_name"]
+    tag = params["tag"]
 
     try:
         cik_info = get_cik(company_name, "cik-ref.json")
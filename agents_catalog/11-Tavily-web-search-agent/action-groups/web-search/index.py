@@ -1,14 +1,31 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 import boto3
+from botocore.config import Config
+from collections import OrderedDict
 import json
 import logging
 import os
+import time
 import urllib.parse
-import urllib.request
+import urllib3
+from urllib3.util.retry import Retry
 
 session = boto3.session.Session()
-secrets_manager = session.client(service_name="secretsmanager")
+secrets_manager = session.client(
+    service_name="secretsmanager",
+    config=Config(
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "standard"},
+        connect_timeout=1,
+        read_timeout=5,
+    ),
+)
+
+# Reuse kept-alive TLS connections to the Tavily API across warm invocations
+http = urllib3.PoolManager(
+    maxsize=10, retries=Retry(total=2, backoff_factor=0.2)
+)
 
 log_level = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
 logging.basicConfig(
@@ -19,6 +36,16 @@ logger.setLevel(log_level)
 
 FUNCTION_NAMES = []
 
+SEARCH_CACHE_ENABLED = (
+    os.environ.get("SEARCH_CACHE_ENABLED", "true").strip().lower() == "true"
+)
+SEARCH_CACHE_MAX_SIZE = int(os.environ.get("SEARCH_CACHE_MAX_SIZE", "256"))
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", "900"))
+
+# Search responses kept across warm invocations, keyed by the normalized query
+# and search options, with TTL expiry and LRU eviction
+_SEARCH_CACHE = OrderedDict()
+
 
 def get_from_env_or_secretstore(SecretId: str) -> str:
     """Get the secret from the environment or secret store"""
@@ -39,6 +66,32 @@ def get_from_env_or_secretstore(SecretId: str) -> str:
     return secret
 
 
+def normalize_query(search_query: str) -> str:
+    """Normalize case and whitespace so trivially different queries share a cache entry"""
+    return " ".join(search_query.lower().split())
+
+
+def get_cached_search(key: tuple) -> str:
+    """Return the cached response for key, or None if missing or expired"""
+    entry = _SEARCH_CACHE.get(key)
+    if entry is None:
+        return None
+    response_data, expires = entry
+    if expires <= time.monotonic():
+        del _SEARCH_CACHE[key]
+        return None
+    _SEARCH_CACHE.move_to_end(key)
+    return response_data
+
+
+def put_cached_search(key: tuple, response_data: str) -> None:
+    """Cache a response, evicting the least recently used entries beyond the max size"""
+    _SEARCH_CACHE[key] = (response_data, time.monotonic() + SEARCH_CACHE_TTL_SECONDS)
+    _SEARCH_CACHE.move_to_end(key)
+    while len(_SEARCH_CACHE) > SEARCH_CACHE_MAX_SIZE:
+        _SEARCH_CACHE.popitem(last=False)
+
+
 try:
     TAVILY_API_KEY_NAME = os.environ.get("TAVILY_API_KEY_NAME", "TAVILY_API_KEY")
     TAVILY_API_KEY = get_from_env_or_secretstore(SecretId=TAVILY_API_KEY_NAME)
@@ -61,12 +114,25 @@ def web_search(
         days: Optional number of days in the past to limit search
         
     Returns:
-        JSON string with search results
+        JSON string with search results. The response body is passed through
+        as-is without being decoded, since the caller only embeds it in text
     """
+    cache_key = (normalize_query(search_query), target_website or "", topic, days)
+    if SEARCH_CACHE_ENABLED:
+        cached_response = get_cached_search(cache_key)
+        if cached_response is not None:
+            logger.info(f"returning cached Tavily AI search for {urllib.parse.quote(search_query)}")
+            return cached_response
+
     logger.info(f"executing Tavily AI search with {urllib.parse.quote(search_query)}")
 
     base_url = "https://api.tavily.com/search"
-    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    # urllib3 transparently decompresses gzip responses
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip",
+    }
     payload = {
         "api_key": TAVILY_API_KEY,
         "query": search_query,
@@ -82,19 +148,24 @@ def web_search(
     }
 
     data = json.dumps(payload).encode("utf-8")
-    request = urllib.request.Request(base_url, data=data, headers=headers)  # nosec: B310 fixed url we want to open
 
     try:
-        response = urllib.request.urlopen(request)  # nosec: B310 fixed url we want to open
-        response_data: str = response.read().decode("utf-8")
-        logger.debug(f"response from Tavily AI search {response_data=}")
-        return response_data
-    except urllib.error.HTTPError as e:
+        response = http.request("POST", base_url, body=data, headers=headers)
+    except urllib3.exceptions.HTTPError as e:
+        logger.error(f"failed to retrieve search results, error: {e}")
+        return ""
+
+    if response.status >= 400:
         logger.error(
-            f"failed to retrieve search results, error: {e.code}"
+            f"failed to retrieve search results, error: {response.status}"
         )
+        return ""
 
-    return ""
+    response_data: str = response.data.decode("utf-8")
+    logger.debug("response from Tavily AI search response_data=%r", response_data)
+    if SEARCH_CACHE_ENABLED and response_data:
+        put_cached_search(cache_key, response_data)
+    return response_data
 
 
 def extract_parameters(event):
@@ -174,7 +245,7 @@ def lambda_handler(event, context):
     Returns:
         Response object in the appropriate format
     """
-    logging.info(f"{event=}")
+    logging.info("event=%r", event)
     
     # Extract parameters regardless of input format
     params = extract_parameters(event)
@@ -202,7 +273,7 @@ def lambda_handler(event, context):
         params["topic"], 
         params["days"]
     )
-    logger.debug(f"query results {search_results=}")
+    logger.debug("query results search_results=%r", search_results)
     
     # Format and return the response
     return format_response(params["search_query"], search_results, event)
@@ -2,10 +2,15 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import boto3
+from botocore.config import Config
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 import json
 import logging
 import os
-from typing import Dict
+import time
+from typing import Optional
 
 log_level = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
 logging.basicConfig(
@@ -15,7 +20,38 @@ logger = logging.getLogger(__name__)
 logger.setLevel(log_level)
 
 session = boto3.session.Session()
-sagemaker = session.client("sagemaker-runtime")
+# Keep connections to both endpoints alive so concurrent calls reuse them, and
+# let adaptive retries absorb endpoint throttling
+sagemaker = session.client(
+    "sagemaker-runtime",
+    config=Config(
+        max_pool_connections=8,
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+    ),
+)
+
+# Endpoint responses are deterministic for a given text, so cache them by a
+# SHA-256 of the text in memory and, only if a table is configured, in DynamoDB
+# so they are shared across Lambda instances. The responses are derived from
+# the medical text and may contain PHI, so the table cache is opt-in.
+CACHE_MAX_SIZE = int(os.environ.get("CACHE_MAX_SIZE", "256"))
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", "86400"))
+CACHE_TABLE_NAME = os.environ.get("CACHE_TABLE_NAME", "").strip()
+dynamodb = (
+    session.client(
+        "dynamodb",
+        config=Config(
+            tcp_keepalive=True,
+            retries={"max_attempts": 3, "mode": "standard"},
+            connect_timeout=1,
+            read_timeout=5,
+        ),
+    )
+    if CACHE_TABLE_NAME
+    else None
+)
+_RESPONSE_CACHE = OrderedDict()
 
 # Get the Sagemaker endpoint name from the environment variables
 endpoint_names = []
@@ -27,11 +63,77 @@ for i in range(1, 3):
     endpoint_names.append(endpoint_name)
 
 
-def call_sagemaker_endpoint(text: str, endpoint_name: str) -> Dict:
+def get_cached_response(cache_key: str) -> Optional[str]:
     """
-    Invoke a sagemaker endpoint with a text string
+    Look up a cached endpoint response in memory, then in DynamoDB
     """
-    logger.debug(f"call_sagemaker_endpoint: {text=}, {endpoint_name=}")
+    response = _RESPONSE_CACHE.get(cache_key)
+    if response is not None:
+        _RESPONSE_CACHE.move_to_end(cache_key)
+        return response
+
+    if dynamodb is None:
+        return None
+
+    try:
+        item = dynamodb.get_item(
+            TableName=CACHE_TABLE_NAME,
+            Key={"cache_key": {"S": cache_key}},
+        ).get("Item")
+    except Exception as e:
+        logger.warning(f"could not read cache table {CACHE_TABLE_NAME}: {e}")
+        return None
+
+    # DynamoDB deletes expired items lazily, so check the TTL here as well
+    if item is None or int(item["expires_at"]["N"]) <= time.time():
+        return None
+
+    response = item["response"]["S"]
+    put_cached_response(cache_key, response, persist=False)
+    return response
+
+
+def put_cached_response(cache_key: str, response: str, persist: bool = True) -> None:
+    """
+    Cache an endpoint response in memory and, if persist is set, in DynamoDB
+    """
+    if CACHE_MAX_SIZE > 0:
+        _RESPONSE_CACHE[cache_key] = response
+        _RESPONSE_CACHE.move_to_end(cache_key)
+        while len(_RESPONSE_CACHE) > CACHE_MAX_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+
+    if dynamodb is None or not persist:
+        return
+
+    try:
+        dynamodb.put_item(
+            TableName=CACHE_TABLE_NAME,
+            Item={
+                "cache_key": {"S": cache_key},
+                "response": {"S": response},
+                "expires_at": {"N": str(int(time.time()) + CACHE_TTL_SECONDS)},
+            },
+        )
+    except Exception as e:
+        logger.warning(f"could not write cache table {CACHE_TABLE_NAME}: {e}")
+
+
+def call_sagemaker_endpoint(text: str, endpoint_name: str) -> str:
+    """
+    Invoke a sagemaker endpoint with a text string, reusing cached responses
+    """
+    logger.debug(
+        "call_sagemaker_endpoint: text=%r, endpoint_name=%r", text, endpoint_name
+    )
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    cache_key = f"{endpoint_name}#{text_hash}"
+
+    cached_response = get_cached_response(cache_key)
+    if cached_response is not None:
+        logger.debug(f"call_sagemaker_endpoint: cache hit for {cache_key=}")
+        return cached_response
+
     # Call the Sagemaker endpoint
     response = sagemaker.invoke_endpoint(
         EndpointName=endpoint_name,
@@ -41,11 +143,35 @@ def call_sagemaker_endpoint(text: str, endpoint_name: str) -> Dict:
 
     # Parse the response
     response_body = json.loads(response["Body"].read().decode("utf-8"))
-    return json.dumps(response_body, separators=(",", ":"))
+    result = json.dumps(response_body, separators=(",", ":"))
+    put_cached_response(cache_key, result)
+    return result
+
+
+def call_all_sagemaker_endpoints(text: str) -> str:
+    """
+    Invoke every endpoint concurrently with a text string
+    """
+    function_names = [
+        "extract_social_determinants_of_health",
+        "extract_icd_10_cm_sentence_entities",
+    ]
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(endpoint_names)) as executor:
+        futures = {
+            executor.submit(call_sagemaker_endpoint, text, endpoint_name): name
+            for name, endpoint_name in zip(function_names, endpoint_names)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = json.loads(future.result())
+
+    return json.dumps(
+        {name: results[name] for name in function_names}, separators=(",", ":")
+    )
 
 
 def lambda_handler(event, context):
-    logging.debug(f"{event=}")
+    logging.debug("event=%r", event)
 
     agent = event["agent"]
     actionGroup = event["actionGroup"]
@@ -55,11 +181,8 @@ def lambda_handler(event, context):
 
     logger.info(f"{agent=}\n{actionGroup=}\n{function=}")
 
-    medical_text = None
-
-    for param in parameters:
-        if param["name"] == "medical_text":
-            medical_text = param["value"]
+    params = {param["name"]: param.get("value") for param in parameters}
+    medical_text = params.get("medical_text")
 
     if not medical_text:
         responseBody = {"TEXT": {"body": "Missing mandatory parameter: medical_text"}}
@@ -72,6 +195,8 @@ def lambda_handler(event, context):
             ade_results = call_sagemaker_endpoint(
                 medical_text, endpoint_name=endpoint_names[1]
             )
+        elif function == "extract_all":
+            ade_results = call_all_sagemaker_endpoints(medical_text)
         else:
             responseBody = {"TEXT": {"body": f"Error, unknown function: {function}"}}
 
@@ -92,7 +217,7 @@ def lambda_handler(event, context):
         "messageVersion": event["messageVersion"],
     }
 
-    logger.debug(f"lambda_handler: {function_response=}")
+    logger.debug("lambda_handler: function_response=%r", function_response)
 
     return function_response
 
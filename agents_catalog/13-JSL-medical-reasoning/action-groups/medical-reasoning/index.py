@@ -2,10 +2,10 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import boto3
+from botocore.config import Config
 import json
 import logging
 import os
-from typing import Dict
 
 log_level = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
 logging.basicConfig(
@@ -14,8 +14,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(log_level)
 
-session = boto3.session.Session()
-sagemaker = session.client("sagemaker-runtime")
+# Created on first use to keep client construction off the cold-start path
+_sagemaker = None
 
 # Get the Sagemaker endpoint name from the environment variables
 endpoint_names = []
@@ -26,11 +26,29 @@ if not endpoint_name:
 endpoint_names.append(endpoint_name)
 
 
-def call_sagemaker_endpoint(text: str, endpoint_name: str) -> Dict:
+def get_sagemaker_client():
+    """Return the SageMaker runtime client, creating it on first use"""
+    global _sagemaker
+    if _sagemaker is None:
+        # Keep the connection alive across warm invocations. The read timeout
+        # is left at its default since a full generation can take a while
+        _sagemaker = boto3.session.Session().client(
+            "sagemaker-runtime",
+            config=Config(
+                tcp_keepalive=True,
+                retries={"max_attempts": 3, "mode": "standard"},
+            ),
+        )
+    return _sagemaker
+
+
+def call_sagemaker_endpoint(text: str, endpoint_name: str) -> str:
     """
     Invoke a sagemaker endpoint with a text string
     """
-    logger.debug(f"call_sagemaker_endpoint: {text=}, {endpoint_name=}")
+    logger.debug(
+        "call_sagemaker_endpoint: text=%r, endpoint_name=%r", text, endpoint_name
+    )
 
     prompt = {
         "model": "/opt/ml/model",
@@ -47,33 +65,29 @@ def call_sagemaker_endpoint(text: str, endpoint_name: str) -> Dict:
     }
 
     # Call the Sagemaker endpoint
-    response = sagemaker.invoke_endpoint(
+    response = get_sagemaker_client().invoke_endpoint(
         EndpointName=endpoint_name,
-        Body=json.dumps(prompt),
+        Body=json.dumps(prompt, separators=(",", ":")),
         ContentType="application/json",
     )
 
-    # Parse the response
-    response_body = json.loads(response["Body"].read().decode("utf-8"))
-    return json.dumps(response_body, separators=(",", ":"))
+    # The caller only embeds the JSON text in the agent response, so it is
+    # returned as received instead of being parsed and re-serialized
+    return response["Body"].read().decode("utf-8")
 
 
 def lambda_handler(event, context):
-    logging.debug(f"{event=}")
+    logging.debug("event=%r", event)
 
     agent = event["agent"]
     actionGroup = event["actionGroup"]
     function = event["function"]
-    parameters = event.get("parameters", [])
+    params = {p["name"]: p["value"] for p in event.get("parameters", [])}
     responseBody = {"TEXT": {"body": "Error, no function was called"}}
 
     logger.info(f"{agent=}\n{actionGroup=}\n{function=}")
 
-    medical_text = None
-
-    for param in parameters:
-        if param["name"] == "medical_text":
-            medical_text = param["value"]
+    medical_text = params.get("medical_text")
 
     if not medical_text:
         responseBody = {"TEXT": {"body": "Missing mandatory parameter: medical_text"}}
@@ -102,7 +116,7 @@ def lambda_handler(event, context):
         "messageVersion": event["messageVersion"],
     }
 
-    logger.debug(f"lambda_handler: {function_response=}")
+    logger.debug("lambda_handler: function_response=%r", function_response)
 
     return function_response
 
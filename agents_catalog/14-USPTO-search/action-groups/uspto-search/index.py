@@ -1,15 +1,15 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 import boto3
+from botocore.config import Config
 import datetime
 import json
 import logging
 import os
+from types import MappingProxyType
 import urllib.parse
-import urllib.request
-
-session = boto3.session.Session()
-secrets_manager = session.client(service_name="secretsmanager")
+import urllib3
+from urllib3.util.retry import Retry
 
 log_level = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
 logging.basicConfig(
@@ -20,7 +20,46 @@ logger.setLevel(log_level)
 
 BASE_URL = "https://api.uspto.gov/api/v1/patent/applications/search"
 FUNCTION_NAMES = []
-LIMIT = 25
+# The results are embedded as JSON text in the agent response, so only the
+# most recent filings are requested to keep the payload the model ingests small
+LIMIT = int(os.environ.get("MAX_RESULTS", "10"))
+API_KEY_NAME = os.environ.get("USPTO_API_KEY_NAME", "USPTO_API_KEY")
+HTTP_RETRY = 3
+SLEEP_AFTER_429 = 0.5
+
+# Reuse kept-alive TLS connections to the USPTO API across warm invocations.
+# The search is read-only, so POSTs are retried on throttling and server errors.
+http = urllib3.PoolManager(
+    maxsize=4,
+    retries=Retry(
+        total=HTTP_RETRY,
+        backoff_factor=SLEEP_AFTER_429,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        raise_on_status=False,
+    ),
+)
+
+# Created on first use so cold starts with the key in the environment never
+# construct a Secrets Manager client
+_secrets_manager = None
+_headers = None
+
+
+def get_secrets_manager():
+    """Return the Secrets Manager client, creating it on first use"""
+    global _secrets_manager
+    if _secrets_manager is None:
+        _secrets_manager = boto3.session.Session().client(
+            service_name="secretsmanager",
+            config=Config(
+                tcp_keepalive=True,
+                retries={"max_attempts": 3, "mode": "standard"},
+                connect_timeout=1,
+                read_timeout=5,
+            ),
+        )
+    return _secrets_manager
 
 
 def get_from_env_or_secretstore(SecretId: str) -> str:
@@ -32,7 +71,7 @@ def get_from_env_or_secretstore(SecretId: str) -> str:
     else:
         logger.debug(f"getting {SecretId} from secrets manager")
         try:
-            secret = secrets_manager.get_secret_value(SecretId=SecretId).get(
+            secret = get_secrets_manager().get_secret_value(SecretId=SecretId).get(
                 "SecretString", ""
             )
         except Exception as e:
@@ -42,13 +81,36 @@ def get_from_env_or_secretstore(SecretId: str) -> str:
     return secret
 
 
-try:
-    API_KEY_NAME = os.environ.get("USPTO_API_KEY_NAME", "USPTO_API_KEY")
-    API_KEY = get_from_env_or_secretstore(SecretId=API_KEY_NAME)
-    FUNCTION_NAMES.append("uspto_search")
-except Exception as e:
-    logger.error(f"could not get API key: {e}")
-    API_KEY = None
+def get_headers() -> dict:
+    """Return the USPTO request headers, fetching the API key on first use"""
+    global _headers
+    if _headers is None:
+        api_key = get_from_env_or_secretstore(SecretId=API_KEY_NAME)
+        _headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "X-API-KEY": api_key,
+        }
+        FUNCTION_NAMES.append("uspto_search")
+    return _headers
+
+
+# The invariant part of the search payload is built once; each search only
+# adds its query and optional filing date range
+PAYLOAD_TEMPLATE = MappingProxyType(
+    {
+        "sort": [{"field": "applicationMetaData.effectiveFilingDate", "order": "desc"}],
+        "fields": [
+            "applicationNumberText",
+            "applicationMetaData.firstInventorName",
+            "applicationMetaData.effectiveFilingDate",
+            "applicationMetaData.applicationTypeLabelName",
+            "applicationMetaData.firstApplicantName",
+            "applicationMetaData.inventionTitle",
+        ],
+        "pagination": {"offset": 0, "limit": LIMIT},
+    }
+)
 
 
 def uspto_search(
@@ -67,24 +129,7 @@ def uspto_search(
     """
     logger.info(f"executing USPTO search with {urllib.parse.quote(search_query)}")
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "X-API-KEY": API_KEY,
-    }
-    payload = {
-        "q": search_query,
-        "sort": [{"field": "applicationMetaData.effectiveFilingDate", "order": "desc"}],
-        "fields": [
-            "applicationNumberText",
-            "applicationMetaData.firstInventorName",
-            "applicationMetaData.effectiveFilingDate",
-            "applicationMetaData.applicationTypeLabelName",
-            "applicationMetaData.firstApplicantName",
-            "applicationMetaData.inventionTitle",
-        ],
-        "pagination": {"offset": 0, "limit": LIMIT},
-    }
+    payload = {"q": search_query, **PAYLOAD_TEMPLATE}
 
     if filing_days_in_past:
         end_date = datetime.date.today()
@@ -96,20 +141,30 @@ def uspto_search(
                 "valueTo": str(end_date),
             }
         ]
-    data = json.dumps(payload).encode("utf-8")
-    logger.info(f"search payload: {data}")
-    request = urllib.request.Request(BASE_URL, data=data, headers=headers)  # nosec: B310 fixed url we want to open
 
     try:
-        response = urllib.request.urlopen(request)  # nosec: B310 fixed url we want to open
-        response_data: str = response.read().decode("utf-8")
-        results = json.loads(response_data)
-        logger.info(f"Response from USPTO search {results}")
-        return json.dumps(results, separators=(",", ":"))
-    except urllib.error.HTTPError as e:
-        logger.error(f"failed to retrieve search results, error: {e.code}")
+        headers = get_headers()
+    except Exception as e:
+        logger.error(f"could not get API key: {e}")
+        return ""
 
-    return ""
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    logger.info("search payload: %s", data)
+
+    try:
+        response = http.request("POST", BASE_URL, body=data, headers=headers)
+    except urllib3.exceptions.HTTPError as e:
+        logger.error(f"failed to retrieve search results, error: {e}")
+        return ""
+
+    if response.status >= 400:
+        logger.error(f"failed to retrieve search results, error: {response.status}")
+        return ""
+
+    response_data: str = response.data.decode("utf-8")
+    results = json.loads(response_data)
+    logger.info("Response from USPTO search %s", results)
+    return json.dumps(results, separators=(",", ":"))
 
 
 def extract_parameters(event):
@@ -122,21 +177,16 @@ def extract_parameters(event):
     Returns:
         Tuple of (search_query, days)
     """
-    search_query = None
-    days = None
-
-    # Check if this is a Bedrock ActionGroup format
-    if "parameters" in event and isinstance(event["parameters"], list):
-        for param in event["parameters"]:
-            if param["name"] == "search_query":
-                search_query = param["value"]
-            if param["name"] == "days":
-                days = param["value"]
-    # Check if this is MCP format (direct key-value pairs)
-    elif "search_query" in event:
-        search_query = event["search_query"]
-        if "days" in event:
-            days = event["days"]
+    # Bedrock ActionGroup events carry a list of name/value pairs; MCP events
+    # pass the arguments as top-level keys
+    parameters = event.get("parameters")
+    if isinstance(parameters, list):
+        params = {p["name"]: p["value"] for p in parameters}
+    else:
+        params = event
+
+    search_query = params.get("search_query")
+    days = params.get("days")
 
     return search_query, days
 
@@ -187,7 +237,7 @@ def lambda_handler(event, context):
     Returns:
         Response object in the appropriate format
     """
-    logging.info(f"{event=}")
+    logging.info("event=%r", event)
 
     # Extract parameters regardless of input format
     search_query, days = extract_parameters(event)
@@ -210,7 +260,7 @@ def lambda_handler(event, context):
 
     # Execute the search
     search_results = uspto_search(search_query, days)
-    logger.debug(f"query results {search_results=}")
+    logger.debug("query results search_results=%r", search_results)
 
     # Format and return the response
     return format_response(search_query, search_results, event)
@@ -1,5 +1,43 @@
 import json
-import requests
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+import threading
+from urllib.parse import urlencode
+import urllib3
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
+
+# How long warm containers reuse a ClinicalTrials.gov result, in seconds
+CT_CACHE_TTL = float(os.environ.get("CT_CACHE_TTL", "300"))
+# Sub-requests of a batch call that are sent to ClinicalTrials.gov at once
+BATCH_MAX_WORKERS = 4
+# Conditions longer than this that are top-level OR lists are split across
+# several concurrent searches to keep each request URL well under server limits
+MAX_CONDITION_LENGTH = 1000
+# Tokens that matter when looking for top-level ORs: quotes, parentheses and
+# the OR operator itself
+OR_TOKEN_RE = re.compile(r'[()"]|\s+OR\s+')
+
+# urllib3 ships with the Lambda runtime, so the function needs no requests
+# layer; the pool keeps the ClinicalTrials.gov connection alive when warm and retries
+# throttled or failed GETs with backoff, honouring Retry-After
+http = urllib3.PoolManager(
+    maxsize=10,
+    retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+)
 
 # Mapping input parameters to ClinicalTrials.gov API v2 query keys
 QUERY_MAP = {
@@ -14,29 +52,127 @@ QUERY_MAP = {
     "patient": "query.patient",
 }
 
+# search_trials parameters forwarded to search_studies; comparison has no
+# API key of its own and is dropped there
+SEARCH_TRIAL_PARAMS = (
+    "condition", "intervention", "comparison", "outcome", "location",
+    "title", "sponsor", "lead_sponsor", "study_id", "patient",
+)
+
+# The requested field lists never change, so they are joined once at import
+DEFAULT_SEARCH_FIELDS = ",".join([
+    "NCTId", "BriefTitle", "OverallStatus", "InterventionName", "PrimaryOutcomeMeasure"
+])
+SEARCH_TRIAL_FIELDS = ",".join([
+    "NCTId", "BriefTitle", "OverallStatus", "InterventionName", "Phase",
+    "StartDate", "CompletionDate", "LeadSponsorName"
+])
+STUDY_DETAIL_FIELDS = ",".join([
+    "NCTId", "BriefTitle", "BriefSummary", "Phase",
+    "StartDate", "CompletionDate", "OverallStatus",
+    "ConditionsModule", "EligibilityModule",
+    "ArmsInterventionsModule", "SponsorCollaboratorsModule",
+    "OutcomesModule"
+])
+
+STUDIES_URL = "https://clinicaltrials.gov/api/v2/studies"
+
 def search_studies(query_fields=None, page_size=10, max_pages=1, fields=None):
-    base_url = "https://clinicaltrials.gov/api/v2/studies"
     query_fields = query_fields or {}
-    fields = fields or [
-        "NCTId", "BriefTitle", "OverallStatus", "InterventionName", "PrimaryOutcomeMeasure"
-    ]
 
     params = {
         "format": "json",
         "pageSize": page_size,
-        "fields": ",".join(fields)
+        "fields": fields or DEFAULT_SEARCH_FIELDS
     }
 
-    print("[DEBUG] Initial query fields:")
-    print(json.dumps(query_fields, indent=2))
-
-    for key, value in query_fields.items():
-        if key in QUERY_MAP and value:
-            param_key = QUERY_MAP[key]
-            param_val = value.strip()
-            params[param_key] = param_val
-            print(f"[DEBUG] Added query param: {param_key} = {param_val}")
+    logger.debug("Initial query fields: %s", query_fields)
+
+    # Map the populated fields onto their API keys in one pass; the full
+    # params dict is logged below before the request is sent
+    params.update({
+        QUERY_MAP[key]: value.strip()
+        for key, value in query_fields.items()
+        if key in QUERY_MAP and value
+    })
+
+    condition = params.get("query.cond")
+    if condition and len(condition) > MAX_CONDITION_LENGTH:
+        terms = split_top_level_or(condition)
+        if len(terms) > 1:
+            return _search_split_condition(params, terms, max_pages)
+
+    return _fetch_pages(params, max_pages)
+
+def split_top_level_or(expression):
+    """
+    Split an "A OR B OR C" expression on the ORs that are outside parentheses
+    and double quotes, so "(A OR B) AND C" stays one term.
+    """
+    terms = []
+    depth = 0
+    in_quotes = False
+    start = 0
+    for match in OR_TOKEN_RE.finditer(expression):
+        token = match.group()
+        if token == '"':
+            in_quotes = not in_quotes
+        elif in_quotes:
+            continue
+        elif token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            terms.append(expression[start:match.start()])
+            start = match.end()
+    terms.append(expression[start:])
+    return [term.strip() for term in terms if term.strip()]
+
+def split_terms(terms, max_length=MAX_CONDITION_LENGTH, separator=" OR "):
+    """
+    Group terms into batches whose separator-joined length stays within
+    max_length. A single term longer than max_length gets a batch of its own.
+    """
+    batch = []
+    length = 0
+    for term in terms:
+        added = len(term) + (len(separator) if batch else 0)
+        if batch and length + added > max_length:
+            yield batch
+            batch = []
+            added = len(term)
+            length = 0
+        batch.append(term)
+        length += added
+    if batch:
+        yield batch
+
+def _search_split_condition(params, terms, max_pages):
+    batches = [" OR ".join(batch) for batch in split_terms(terms)]
+    logger.debug("Splitting condition into %s searches", len(batches))
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(batches))) as executor:
+        batch_results = executor.map(
+            lambda condition: _fetch_pages({**params, "query.cond": condition}, max_pages),
+            batches
+        )
+
+        # Merge in batch order, keeping the first copy of a study that matched
+        # several batches
+        results = []
+        seen = set()
+        for studies in batch_results:
+            for study in studies:
+                nct_id = study.get('protocolSection', {}).get('identificationModule', {}).get('nctId')
+                if nct_id is None or nct_id not in seen:
+                    seen.add(nct_id)
+                    results.append(study)
+
+    logger.debug("Total results retrieved: %s", len(results))
+    return results
 
+def _fetch_pages(params, max_pages):
     results = []
     next_token = None
     page = 0
@@ -44,62 +180,186 @@ def search_studies(query_fields=None, page_size=10, max_pages=1, fields=None):
     while page < max_pages:
         if next_token:
             params["pageToken"] = next_token
-            print(f"[DEBUG] Fetching page {page + 1} with token: {next_token}")
+            logger.debug("Fetching page %s with token: %s", page + 1, next_token)
 
-        print("[DEBUG] Sending request to ClinicalTrials.gov with params:")
-        print(json.dumps(params, indent=2))
+        logger.debug("Sending request to ClinicalTrials.gov with params: %s", params)
 
-        res = requests.get(base_url, params=params)
-        print(f"[DEBUG] Requested URL: {res.url}")
+        res = http.request("GET", STUDIES_URL, fields=params)
+        logger.debug("Requested URL: %s?%s", STUDIES_URL, urlencode(params))
 
-        if res.status_code != 200:
-            print(f"[ERROR] API call failed with status code {res.status_code}")
-            raise Exception(f"API call failed: {res.status_code} - {res.text}")
+        if res.status != 200:
+            logger.error("API call failed with status code %s", res.status)
+            raise Exception(f"API call failed: {res.status} - {res.data.decode('utf-8')}")
 
-        data = res.json()
+        data = json.loads(res.data)
         page_results = data.get("studies", [])
-        print(f"[DEBUG] Retrieved {len(page_results)} results on page {page + 1}")
+        logger.debug("Retrieved %s results on page %s", len(page_results), page + 1)
         results.extend(page_results)
 
         next_token = data.get("nextPageToken")
         if not next_token:
-            print("[DEBUG] No more pages to fetch.")
+            logger.debug("No more pages to fetch.")
             break
 
         page += 1
 
-    print(f"[DEBUG] Total results retrieved: {len(results)}")
+    logger.debug("Total results retrieved: %s", len(results))
     return results
 
-def get_study_details(nct_id):
-    print(f"[DEBUG] Fetching study details for NCT ID: {nct_id}")
+def fetch_study_details(nct_id, fields=None):
+    """
+    Return the raw JSON bytes of a study record from ClinicalTrials.gov.
+    """
+    logger.debug("Fetching study details for NCT ID: %s", nct_id)
 
-    url = f"https://clinicaltrials.gov/api/v2/studies/{nct_id}"
+    url = f"{STUDIES_URL}/{nct_id}"
     params = {
         "format": "json",
         "markupFormat": "markdown",
-        "fields": ",".join([
-            "NCTId", "BriefTitle", "BriefSummary", "Phase",
-            "StartDate", "CompletionDate", "OverallStatus",
-            "ConditionsModule", "EligibilityModule",
-            "ArmsInterventionsModule", "SponsorCollaboratorsModule",
-            "OutcomesModule"
-        ])
+        "fields": fields or STUDY_DETAIL_FIELDS
     }
 
-    print("[DEBUG] Sending request to ClinicalTrials.gov:")
-    print(json.dumps(params, indent=2))
-
-    res = requests.get(url, params=params)
-    print(f"[DEBUG] Requested URL: {res.url}")
-
-    if res.status_code != 200:
-        print(f"[ERROR] Study details API failed with status {res.status_code}")
-        raise Exception(f"Study details API failed: {res.status_code}")
-
-    study_data = res.json()
-    print("[DEBUG] Study data retrieved successfully.")
-    return study_data
+    logger.debug("Sending request to ClinicalTrials.gov: %s", params)
+
+    res = http.request("GET", url, fields=params)
+    logger.debug("Requested URL: %s?%s", url, urlencode(params))
+
+    if res.status != 200:
+        logger.error("Study details API failed with status %s", res.status)
+        raise Exception(f"Study details API failed: {res.status}")
+
+    logger.debug("Study data retrieved successfully.")
+    return res.data
+
+def ttl_cache(maxsize=256, ttl=CT_CACHE_TTL):
+    """
+    Memoize a function of hashable positional arguments for up to `ttl`
+    seconds, evicting the least recently used entry beyond `maxsize`.
+    Exceptions are not cached.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        # batch calls read and fill the cache from several threads
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(args)
+                if entry is not None and now - entry[0] < ttl:
+                    cache.move_to_end(args)
+                    return entry[1]
+            value = func(*args)
+            with lock:
+                cache[args] = (now, value)
+                cache.move_to_end(args)
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        return wrapper
+    return decorator
+
+# Agents often repeat a search or detail lookup within a conversation, so warm
+# containers keep recent results. Searches are keyed by their stripped,
+# non-empty query fields, which is exactly what search_studies sends.
+@ttl_cache(maxsize=256)
+def _cached_search(query_items, page_size, max_pages, fields):
+    return search_studies(
+        query_fields=dict(query_items),
+        page_size=page_size,
+        max_pages=max_pages,
+        fields=fields
+    )
+
+def search_trials(query_fields, page_size=10, max_pages=1, fields=None):
+    query_items = tuple(sorted(
+        (key, value.strip()) for key, value in query_fields.items()
+        if key in QUERY_MAP and value and value.strip()
+    ))
+    return _cached_search(query_items, page_size, max_pages, fields)
+
+@ttl_cache(maxsize=256)
+def get_trial_details(nct_id, fields=None):
+    # The record is only embedded as text in the response, so the API's JSON
+    # is passed through (and cached) without being parsed and re-serialized
+    return fetch_study_details(nct_id, fields).decode("utf-8")
+
+def run_function(function, parameters):
+    """
+    Run one search_trials or get_trial_details call and return the response
+    body text.
+    """
+    if function == "search_trials":
+        query_fields = {key: parameters.get(key) for key in SEARCH_TRIAL_PARAMS}
+
+        logger.debug("Mapped Query Fields for API: %s", query_fields)
+
+        results = search_trials(
+            query_fields=query_fields,
+            page_size=10,
+            max_pages=1,
+            fields=SEARCH_TRIAL_FIELDS
+        )
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Printing summary of retrieved studies:")
+            for study in results:
+                identification = study.get('protocolSection', {}).get('identificationModule', {})
+                logger.debug(" - %s | %s", identification.get('nctId'), identification.get('briefTitle'))
+
+        # Compact JSON is smaller than the Python repr of the same records
+        results_json = json.dumps(results, separators=(",", ":"))
+        return f"Here are the top search results from ClinicalTrials.gov '{results_json}'"
+
+    elif function == "get_trial_details":
+        nct_id = parameters.get("nctId")
+        if not nct_id:
+            raise ValueError("Missing or invalid NCT ID.")
+        # Optional comma-separated field paths (e.g. "BriefTitle,EligibilityCriteria")
+        # let the API return only the leaves the caller needs
+        fields = parameters.get("fields")
+        if fields:
+            fields = ",".join(field.strip() for field in fields.split(",") if field.strip())
+        study = get_trial_details(nct_id.strip().upper(), fields or None)
+        return f"Study details for {nct_id} : '{study}'"
+
+    raise ValueError(f"Unsupported function: {function}")
+
+def run_batch(requests_param):
+    """
+    Run several search_trials / get_trial_details calls concurrently.
+
+    `requests_param` is a JSON list (or an already decoded list) of
+    {"id": ..., "function": ..., "parameters": {name: value}} objects. The
+    result is a JSON list with each request's id and function plus either its
+    "body" or an "error", in request order.
+    """
+    requests = json.loads(requests_param) if isinstance(requests_param, str) else requests_param
+    if not isinstance(requests, list) or not requests:
+        raise ValueError("'requests' must be a non-empty JSON list.")
+
+    def run_one(indexed_request):
+        index, request = indexed_request
+        request_id, function = index, None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Each batch request must be a JSON object.")
+            request_id = request.get("id", index)
+            function = request.get("function")
+            if function == "batch":
+                raise ValueError("Nested batch requests are not supported.")
+            body = run_function(function, request.get("parameters") or {})
+            return {"id": request_id, "function": function, "body": body}
+        except Exception as e:
+            logger.error("Batch request %s failed: %s", request_id, e)
+            return {"id": request_id, "function": function, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(requests))) as executor:
+        results = list(executor.map(run_one, enumerate(requests)))
+
+    return json.dumps(results, separators=(",", ":"))
 
 def lambda_handler(event, context):
     agent = event.get('agent', '')
@@ -107,71 +367,28 @@ def lambda_handler(event, context):
     function = event.get('function', '')
     parameter_list = event.get('parameters', [])
 
-    print("[INFO] Lambda function invoked")
-    print(f"Agent: {agent}")
-    print(f"Action Group: {actionGroup}")
-    print(f"Function: {function}")
-    print(f"Raw Parameter List:\n{json.dumps(parameter_list, indent=2)}")
+    logger.info("Lambda function invoked")
+    logger.info("Agent: %s", agent)
+    logger.info("Action Group: %s", actionGroup)
+    logger.info("Function: %s", function)
+    logger.debug("Raw Parameter List: %s", parameter_list)
 
     parameters = {param["name"]: param["value"] for param in parameter_list if "name" in param and "value" in param}
 
-    print("[DEBUG] Converted Parameters Dictionary:")
-    print(json.dumps(parameters, indent=2))
+    logger.debug("Converted Parameters Dictionary: %s", parameters)
 
     try:
-        if function == "search_trials":
-            query_fields = {
-                "condition": parameters.get("condition"),
-                "intervention": parameters.get("intervention"),
-                "comparison": parameters.get("comparison"),
-                "outcome": parameters.get("outcome"),
-                "location": parameters.get("location"),
-                "title": parameters.get("title"),
-                "sponsor": parameters.get("sponsor"),
-                "lead_sponsor": parameters.get("lead_sponsor"),
-                "study_id": parameters.get("study_id"),
-                "patient": parameters.get("patient"),
-            }
-
-            print("[DEBUG] Mapped Query Fields for API:")
-            print(json.dumps(query_fields, indent=2))
-
-            results = search_studies(
-                query_fields=query_fields,
-                page_size=10,
-                max_pages=1,
-                fields=[
-                    "NCTId", "BriefTitle", "OverallStatus", "InterventionName", "Phase",
-                    "StartDate", "CompletionDate", "LeadSponsorName"
-                ]
-            )
-
-            print("[DEBUG] Printing summary of retrieved studies:")
-            for study in results:
-                study_id = study.get('protocolSection', {}).get('identificationModule', {}).get('nctId')
-                title = study.get('protocolSection', {}).get('identificationModule', {}).get('briefTitle')
-                print(f" - {study_id} | {title}")
-
-            response_body = {
-                "TEXT": {
-                    "body": f"Here are the top search results from ClinicalTrials.gov '{results}'"
-                }
-            }
+        if function == "batch":
+            body = run_batch(parameters.get("requests"))
+        else:
+            body = run_function(function, parameters)
 
-        elif function == "get_trial_details":
-            nct_id = parameters.get("nctId")
-            if not nct_id:
-                raise ValueError("Missing or invalid NCT ID.")
-            study = get_study_details(nct_id)
-            response_body = {
-                "TEXT": {
-                    "body": f"Study details for {nct_id} : '{study}'"
-                }
+        response_body = {
+            "TEXT": {
+                "body": body
             }
+        }
 
-        else:
-            raise ValueError(f"Unsupported function: {function}")
-    
         function_response = {
             'actionGroup': actionGroup,
             'function': function,
@@ -181,7 +398,7 @@ def lambda_handler(event, context):
         }
 
     except Exception as e:
-        print(f"[ERROR] Exception occurred: {str(e)}")
+        logger.error("Exception occurred: %s", e)
         response_state = "FAILURE"
         response_body = {
             "TEXT": {
@@ -205,8 +422,7 @@ def lambda_handler(event, context):
         'promptSessionAttributes': event.get('promptSessionAttributes', {})
     }
 
-    print("[INFO] Final Formatted Lambda Response:")
-    print(json.dumps(action_response, indent=2))
+    logger.debug("Final Formatted Lambda Response: %s", action_response)
 
     return action_response
 
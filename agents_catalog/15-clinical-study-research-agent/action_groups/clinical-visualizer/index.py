@@ -1,80 +1,210 @@
 import os
 os.environ['MPLCONFIGDIR'] = '/tmp'
+import ast
 import json
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import numpy as np
 import io
-import boto3
-import ast
+import math
+from xml.sax.saxutils import escape, quoteattr
 
 import logging
 import uuid
 
-from typing import Dict, Any
-from http import HTTPStatus
-
 import boto3
+from botocore.config import Config
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
 
 import re
 
+# key=value pairs inside the agent's "[{label=Foo, value=1}, ...]" notation
+_KV_RE = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_ ]*?)\s*=\s*([^,{}\[\]]*)')
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+# hex codes (#rgb, #rgba, #rrggbb, #rrggbbaa) or bare CSS color names
+_COLOR_RE = re.compile(r'#(?:[0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})|[A-Za-z]{3,20}')
+
+def _kv_to_literal(match):
+    prefix, key, value = match.groups()
+    value = value.strip()
+    if not _NUMBER_RE.fullmatch(value):
+        value = repr(value)
+    return f"{prefix}{key.strip()!r}: {value}"
+
+# matplotlib is only needed for raster charts, so it is imported on first use
+# and a single figure is then cleared and reused for each chart
+_FIG = None
+_AX = None
+
+# matplotlib's default color cycle, reused by the SVG renderer so both output
+# formats look alike
+PIE_COLORS = [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+    "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+]
+SVG_SIZE = 600
+SVG_RADIUS = 200
+
+# Created once so warm invocations reuse the client and its kept-alive
+# connection for both the upload and the presigned URL
+S3_CLIENT = boto3.client('s3', config=Config(tcp_keepalive=True))
+
+def parse_colors(colors):
+    """
+    Split a comma-separated color string and reject anything that is not a
+    hex code or CSS color name, since colors end up in SVG attributes.
+    """
+    if isinstance(colors, str):
+        colors = [c.strip() for c in colors.split(',') if c.strip()]
+    for color in colors or []:
+        if not isinstance(color, str) or not _COLOR_RE.fullmatch(color):
+            raise ValueError(f"Invalid color: {color!r}. Use hex codes like #1f77b4 or CSS color names.")
+    return colors or PIE_COLORS
+
 def parse_non_json_data_string(data_str: str):
     """
     Convert non-JSON string to a proper list of dicts.
     Example: "[{label=Foo, value=1}, {label=Bar, value=2}]"
     """
-    print("[DEBUG] Raw data string before parsing:")
-    print(data_str)
+    logger.debug("Raw data string before parsing: %s", data_str)
 
-    # Convert it to JSON-like syntax
-    data_str = data_str.replace('=', ':')
-    data_str = re.sub(r'([{,]\s*)([a-zA-Z_][a-zA-Z0-9_ ]*)(\s*):', r'\1"\2"\3:', data_str)
-    data_str = re.sub(r':\s*([^"{\[\]},]+)', lambda m: f': "{m.group(1).strip()}"' if not m.group(1).strip().isdigit() else f': {m.group(1).strip()}', data_str)
-
-    print("[DEBUG] Data string after fix-up:")
-    print(data_str)
-
-    return json.loads(data_str)
+    # The agent sometimes sends real JSON, which needs no rewriting
+    try:
+        return json.loads(data_str)
+    except ValueError:
+        pass
+
+    # Quote keys and non-numeric values in one pass, producing a Python
+    # literal that ast.literal_eval can read (numbers keep their type)
+    data_str = _KV_RE.sub(_kv_to_literal, data_str)
+
+    logger.debug("Data string after fix-up: %s", data_str)
+
+    return ast.literal_eval(data_str)
+
+def get_figure():
+    global _FIG, _AX
+    if _FIG is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        _FIG, _AX = plt.subplots(figsize=(6, 6))
+    return _FIG, _AX
+
+def render_pie_chart_webp(title, labels, values, colors=None):
+    fig, ax = get_figure()
+    ax.clear()
+    ax.set_title(title)
+    ax.pie(values, labels=labels, autopct='%1.1f%%', colors=parse_colors(colors))
+    ax.set_aspect('equal')
+    fig.tight_layout()
+    # Render into memory and stream the buffer to S3 instead of writing to /tmp
+    buf = io.BytesIO()
+    # WebP at screen resolution is a fraction of the size of the PNG
+    # matplotlib writes by default and keeps the labels legible
+    fig.savefig(buf, format='webp', dpi=100, pil_kwargs={'quality': 85})
+    buf.seek(0)
+    return buf
+
+def render_pie_chart_svg(title, labels, values, colors=None):
+    """
+    Render a pie chart as a standalone SVG document without matplotlib.
+    Slices start at 12 o'clock and run clockwise, labelled like the raster
+    chart with the label outside and the percentage inside each slice.
+    """
+    values = [float(v) for v in values]
+    total = sum(values)
+    # A negative (or NaN) slice would draw a backwards arc over its neighbours
+    if not all(v >= 0 for v in values) or total <= 0:
+        raise ValueError("Pie chart values must be non-negative and sum to a positive number.")
+    colors = parse_colors(colors)
+
+    cx = SVG_SIZE / 2
+    cy = SVG_SIZE / 2 + 20
+    r = SVG_RADIUS
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{SVG_SIZE}" height="{SVG_SIZE}" '
+        f'viewBox="0 0 {SVG_SIZE} {SVG_SIZE}" font-family="sans-serif" font-size="14">',
+        '<rect width="100%" height="100%" fill="#fff"/>',
+        f'<text x="{cx}" y="40" text-anchor="middle" font-size="18">{escape(str(title))}</text>',
+    ]
+
+    angle = 0.0
+    for i, (label, value) in enumerate(zip(labels, values)):
+        fraction = value / total
+        sweep = fraction * 2 * math.pi
+        color = quoteattr(colors[i % len(colors)])
+        if fraction >= 1:
+            parts.append(f'<circle cx="{cx}" cy="{cy}" r="{r}" fill={color}/>')
+        elif fraction > 0:
+            x1 = cx + r * math.sin(angle)
+            y1 = cy - r * math.cos(angle)
+            x2 = cx + r * math.sin(angle + sweep)
+            y2 = cy - r * math.cos(angle + sweep)
+            large_arc = 1 if sweep > math.pi else 0
+            parts.append(
+                f'<path d="M{cx},{cy} L{x1:.2f},{y1:.2f} '
+                f'A{r},{r} 0 {large_arc} 1 {x2:.2f},{y2:.2f} Z" fill={color}/>'
+            )
 
-def generate_pie_chart_and_upload(title, data, colors=None, bucket_name=None, folder="charts"):
-    print("[INFO] Starting pie chart generation")
+        mid = angle + sweep / 2
+        sin_mid, cos_mid = math.sin(mid), math.cos(mid)
+        anchor = "start" if sin_mid > 0.1 else "end" if sin_mid < -0.1 else "middle"
+        parts.append(
+            f'<text x="{cx + 0.6 * r * sin_mid:.2f}" y="{cy - 0.6 * r * cos_mid:.2f}" '
+            f'text-anchor="middle" dominant-baseline="middle">{fraction * 100:.1f}%</text>'
+        )
+        parts.append(
+            f'<text x="{cx + 1.1 * r * sin_mid:.2f}" y="{cy - 1.1 * r * cos_mid:.2f}" '
+            f'text-anchor="{anchor}" dominant-baseline="middle">{escape(str(label))}</text>'
+        )
+        angle += sweep
+
+    parts.append('</svg>')
+    return io.BytesIO("\n".join(parts).encode("utf-8"))
+
+# format -> (file extension, content type, renderer)
+CHART_FORMATS = {
+    "svg": ("svg", "image/svg+xml", render_pie_chart_svg),
+    "webp": ("webp", "image/webp", render_pie_chart_webp),
+}
+
+def generate_pie_chart_and_upload(title, data, colors=None, bucket_name=None, folder="charts", chart_format="svg"):
+    logger.info("Starting pie chart generation")
     data = parse_non_json_data_string(data)
 
-    labels = [item['label'] for item in data]
-    values = [item['value'] for item in data]
+    labels = []
+    values = []
+    for item in data:
+        labels.append(item['label'])
+        values.append(item['value'])
 
-    filename = f"{uuid.uuid4()}.png"
-    file_path = f"/tmp/{filename}"
+    extension, content_type, render = CHART_FORMATS[chart_format]
+    filename = f"{uuid.uuid4()}.{extension}"
     s3_key = f"{folder}/{filename}" if folder else filename
 
     # Generate pie chart
-    plt.figure(figsize=(6, 6))
-    plt.title(title)
-    plt.pie(values, labels=labels, autopct='%1.1f%%', colors=colors)
-    plt.axis('equal')
-    plt.tight_layout()
-    plt.savefig(file_path)
-    plt.close()
-    print(f"[INFO] Chart saved at {file_path}")
+    buf = render(title, labels, values, colors=colors)
+    logger.info("Chart rendered as %s (%s bytes)", chart_format, buf.getbuffer().nbytes)
 
     # Upload to S3
-    s3 = boto3.client('s3')
-    print(f"[INFO] Uploading to S3 bucket: {bucket_name}, key: {s3_key}")
-    s3.upload_file(file_path, bucket_name, s3_key, ExtraArgs={"ContentType": "image/png"})
+    logger.info("Uploading to S3 bucket: %s, key: %s", bucket_name, s3_key)
+    # Charts are a few KB to a few hundred KB, so a single put_object of the
+    # rendered bytes beats going through the transfer manager
+    S3_CLIENT.put_object(
+        Bucket=bucket_name,
+        Key=s3_key,
+        Body=buf.getvalue(),
+        ContentType=content_type
+    )
 
-    presigned_url = s3.generate_presigned_url(
+    # Presigning is a local signing operation with no request to S3
+    presigned_url = S3_CLIENT.generate_presigned_url(
         ClientMethod="get_object",
         Params={"Bucket": bucket_name, "Key": s3_key},
         ExpiresIn=3600
     )
 
-    os.remove(file_path)
-    print("[INFO] Temporary file deleted")
-    print("[INFO] Presigned URL generated")
+    logger.info("Presigned URL generated")
 
     return presigned_url
 
@@ -84,16 +214,15 @@ def lambda_handler(event, context):
     function = event.get('function', '')
     parameter_list = event.get('parameters', [])
 
-    print("[INFO] Lambda function invoked")
-    print(f"Agent: {agent}")
-    print(f"Action Group: {actionGroup}")
-    print(f"Function: {function}")
-    print(f"Raw Parameter List:\n{json.dumps(parameter_list, indent=2)}")
+    logger.info("Lambda function invoked")
+    logger.info("Agent: %s", agent)
+    logger.info("Action Group: %s", actionGroup)
+    logger.info("Function: %s", function)
+    logger.debug("Raw Parameter List: %s", parameter_list)
 
     parameters = {param["name"]: param["value"] for param in parameter_list if "name" in param and "value" in param}
 
-    print("[DEBUG] Converted Parameters Dictionary:")
-    print(json.dumps(parameters, indent=2))
+    logger.debug("Converted Parameters Dictionary: %s", parameters)
 
     try:
         if function == "create_pie_chart":
@@ -106,6 +235,9 @@ def lambda_handler(event, context):
 
             colors = parameters.get("colors")
             folder = parameters.get("folder", "charts")
+            chart_format = parameters.get("format", "svg").strip().lower()
+            if chart_format not in CHART_FORMATS:
+                raise ValueError(f"Unsupported chart format: {chart_format}. Use one of: {', '.join(CHART_FORMATS)}.")
 
             bucket_name = os.environ.get("CHART_IMAGE_BUCKET")
             if not bucket_name:
@@ -116,7 +248,8 @@ def lambda_handler(event, context):
                 data=data,
                 colors=colors,
                 bucket_name=bucket_name,
-                folder=folder
+                folder=folder,
+                chart_format=chart_format
             )
 
             response_body = {
@@ -137,7 +270,7 @@ def lambda_handler(event, context):
         }
 
     except Exception as e:
-        print(f"[ERROR] Exception occurred: {str(e)}")
+        logger.error("Exception occurred: %s", e)
         response_body = {
             "TEXT": {
                 "body": f"An error occurred: {str(e)}"
@@ -160,7 +293,6 @@ def lambda_handler(event, context):
         'promptSessionAttributes': event.get('promptSessionAttributes', {})
     }
 
-    print("[INFO] Final Formatted Lambda Response:")
-    print(json.dumps(action_response, indent=2))
+    logger.debug("Final Formatted Lambda Response: %s", action_response)
 
     return action_response
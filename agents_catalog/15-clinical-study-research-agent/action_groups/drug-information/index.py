@@ -1,59 +1,169 @@
 import json
-import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+import urllib3
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
 
 OPEN_FDA_URL = "https://api.fda.gov/drug/drugsfda.json"
+# How long warm containers reuse an openFDA summary, in seconds
+CT_CACHE_TTL = float(os.environ.get("CT_CACHE_TTL", "300"))
+# A condition longer than this that is a top-level "A OR B OR C" list is
+# searched one term at a time, at most MAX_CONDITION_WORKERS at once
+MAX_CONDITION_LENGTH = 1000
+MAX_CONDITION_WORKERS = 4
+# Tokens that matter when looking for top-level ORs: quotes, parentheses and
+# the OR operator itself
+OR_TOKEN_RE = re.compile(r'[()"]|\s+OR\s+')
+QUOTE = '"'
+
+# urllib3 ships with the Lambda runtime, so the function needs no requests
+# layer; the pool keeps the openFDA connection alive when warm and retries
+# throttled or failed GETs with backoff, honouring Retry-After
+http = urllib3.PoolManager(
+    maxsize=10,
+    retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+)
 
-def sanitize(value):
-    if value and ' ' in value and not value.startswith('"'):
-        return f'"{value}"'
-    return value
-    
 def query_fda(condition=None, route=None, limit=100):
-    search_terms = []
-    if condition:
-        search_terms.append(f'indications_and_usage:{sanitize(condition)}')
-    if route:
-        search_terms.append(f'route:{sanitize(route)}')
-
+    # Each value is searched as a quoted phrase joined with a plain " AND ";
+    # urlencode turns the spaces into the "+AND+" openFDA expects
+    search_terms = [
+        f'{field}:"{value.strip().strip(QUOTE)}"'
+        for field, value in (("indications_and_usage", condition), ("route", route))
+        if value and value.strip().strip(QUOTE)
+    ]
 
     params = {
-        'search': '+AND+'.join(search_terms),
+        'search': ' AND '.join(search_terms),
         'limit': limit
     }
 
-    print("[DEBUG] FDA Query Params:")
-    print(json.dumps(params, indent=2))
-
-    response = requests.get(OPEN_FDA_URL, params=params)
-    print(f"[DEBUG] Requested URL: {response.url}")
-
-    if response.status_code != 200:
-        raise Exception(f"OpenFDA API call failed: {response.status_code} - {response.text}")
-
-    return response.json().get("results", [])
+    logger.debug("FDA Query Params: %s", params)
+
+    response = http.request("GET", OPEN_FDA_URL, fields=params)
+    logger.debug("Requested URL: %s?%s", OPEN_FDA_URL, urlencode(params))
+
+    # openFDA answers a search without matches with 404 NOT_FOUND
+    if response.status == 404:
+        return []
+
+    if response.status != 200:
+        raise Exception(f"OpenFDA API call failed: {response.status} - {response.data.decode('utf-8')}")
+
+    return json.loads(response.data).get("results", [])
+
+def split_top_level_or(expression):
+    """
+    Split an "A OR B OR C" expression on the ORs that are outside parentheses
+    and double quotes, so "(A OR B) AND C" stays one term.
+    """
+    terms = []
+    depth = 0
+    in_quotes = False
+    start = 0
+    for match in OR_TOKEN_RE.finditer(expression):
+        token = match.group()
+        if token == '"':
+            in_quotes = not in_quotes
+        elif in_quotes:
+            continue
+        elif token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            terms.append(expression[start:match.start()])
+            start = match.end()
+    terms.append(expression[start:])
+    return [term.strip() for term in terms if term.strip()]
+
+def query_fda_conditions(conditions, route=None):
+    """
+    Query openFDA for each condition concurrently and merge the results,
+    keeping the first copy of an application that matches several conditions.
+    """
+    with ThreadPoolExecutor(max_workers=min(MAX_CONDITION_WORKERS, len(conditions))) as executor:
+        per_condition = list(executor.map(lambda condition: query_fda(condition=condition, route=route), conditions))
+
+    results = []
+    seen = set()
+    for fda_results in per_condition:
+        for item in fda_results:
+            application_number = item.get("application_number")
+            if application_number is None or application_number not in seen:
+                seen.add(application_number)
+                results.append(item)
+    return results
 
 def summarize_drugs(fda_results):
-    unique_drugs = set()
-    route_counts = {}
-
-    for item in fda_results:
-        products = item.get("products", [])
-        for product in products:
-            brand_name = product.get("brand_name")
-            route = product.get("route")
-
-            if brand_name:
-                unique_drugs.add(brand_name)
-
-            if route:
-                route_counts[route] = route_counts.get(route, 0) + 1
+    products = [product for item in fda_results for product in item.get("products", [])]
+    unique_drugs = {product["brand_name"] for product in products if product.get("brand_name")}
+    route_counts = Counter(product["route"] for product in products if product.get("route"))
 
     return {
         "total_drugs": len(unique_drugs),
-        "routes": route_counts,
+        "routes": dict(route_counts),
         "drug_names": list(unique_drugs)[:10]  # Limit to top 10 for brevity
     }
 
+def ttl_cache(maxsize=256, ttl=CT_CACHE_TTL):
+    """
+    Memoize a function of hashable positional arguments for up to `ttl`
+    seconds, evicting the least recently used entry beyond `maxsize`.
+    Exceptions are not cached.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        # keep the cache consistent if it is ever called from several threads
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(args)
+                if entry is not None and now - entry[0] < ttl:
+                    cache.move_to_end(args)
+                    return entry[1]
+            value = func(*args)
+            with lock:
+                cache[args] = (now, value)
+                cache.move_to_end(args)
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        return wrapper
+    return decorator
+
+@ttl_cache(maxsize=128)
+def get_drug_summary(condition=None, route=None):
+    # Warm containers reuse the summary for a repeated condition/route instead
+    # of re-querying and re-counting; entries expire after CT_CACHE_TTL so
+    # new approvals and empty (404) results are picked up again
+    if condition and len(condition) > MAX_CONDITION_LENGTH:
+        conditions = split_top_level_or(condition)
+        if len(conditions) > 1:
+            return summarize_drugs(query_fda_conditions(conditions, route=route))
+    return summarize_drugs(query_fda(condition=condition, route=route))
+
 def lambda_handler(event, context):
     agent = event.get('agent', '')
     actionGroup = event.get('actionGroup', '')
@@ -62,9 +172,9 @@ def lambda_handler(event, context):
     session_attributes = event.get('sessionAttributes', {})
     prompt_session_attributes = event.get('promptSessionAttributes', {})
 
-    print("[INFO] Lambda function invoked")
-    print(f"Function: {function}")
-    print(f"Parameters:\n{json.dumps(parameter_list, indent=2)}")
+    logger.info("Lambda function invoked")
+    logger.info("Function: %s", function)
+    logger.debug("Parameters: %s", parameter_list)
 
     # Convert to dict
     parameters = {param["name"]: param["value"] for param in parameter_list if "name" in param and "value" in param}
@@ -72,8 +182,7 @@ def lambda_handler(event, context):
     route = parameters.get("route")
 
     try:
-        raw_results = query_fda(condition=condition, route=route)
-        summary = summarize_drugs(raw_results)
+        summary = get_drug_summary(condition, route)
 
         response_body = {
             "TEXT": {
@@ -86,7 +195,7 @@ def lambda_handler(event, context):
         response_state = "SUCCESS"
 
     except Exception as e:
-        print(f"[ERROR] {str(e)}")
+        logger.error("Failed to retrieve approved drugs: %s", e)
         response_state = "FAILURE"
         response_body = {
             "TEXT": {
@@ -16,6 +16,14 @@ def load_cdm():
         logger.error(f"Failed to load CDM: {e}")
         return {}
 
+# The CDM ships with the deployment package and never changes, so it is parsed
+# once per container rather than on every invocation
+CLINICAL_PROTOCOL_CDM = load_cdm()
+# The response text is fixed as well, so it is serialized up front as compact
+# JSON instead of formatting the dict's repr on each call
+_CDM_JSON = json.dumps(CLINICAL_PROTOCOL_CDM, separators=(',', ':'))
+_CDM_BODY = f"Here is the full Clinical Document Model (CDM) : {_CDM_JSON}"
+
 def lambda_handler(event, context):
     
     agent = event.get('agent', '')
@@ -26,10 +34,6 @@ def lambda_handler(event, context):
     logger.info("Lambda invoked")
     logger.info(f"Agent: {agent}, Function: {function}, ActionGroup: {actionGroup}")
 
-    clinical_protocol_cdm = load_cdm()
-
-    logger.info(f"cdm loaded: {clinical_protocol_cdm}")
-
     try:
         if function != "getClinicalProtocolTemplate":
             raise ValueError(f"Unsupported function: {function}")
@@ -37,7 +41,7 @@ def lambda_handler(event, context):
         # Ignore specific 'sections' parameter, always return full CDM
         response_body = {
             "TEXT": {
-                "body": f"Here is the full Clinical Document Model (CDM) : {clinical_protocol_cdm}"
+                "body": _CDM_BODY
             }
         }
 